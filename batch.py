@@ -0,0 +1,193 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from parser import load_problem
+from parallel import get_context
+from solver import (TIMEOUT_SECONDS, branch_and_bound, build_initial_state, depth_first_branch_and_bound,
+                    find_initial_bound, final_cost, state_from_slots)
+from state import State
+
+# Batch mode: many instances and/or many weight vectors. Each instance is parsed and
+# preprocessed (valid slots, propagation, symmetry classes, greedy schedule) once in the
+# main process; the weight-independent result is inherited by the pool workers (fork)
+# and only the Branch-and-Bound search runs per job. Every schedule found for an
+# instance is re-scored under the weights of the later jobs and the cheapest one is
+# their starting bound.
+
+# Instance path -> (problem, initial state, greedy schedule as a slot-index array or None),
+# or (None, failure, None) if the instance has no schedule. Filled by prepare().
+PREPARED = {}
+
+def parse_weights(text):
+    # "1,1,1,1,1,1,1,1" (the 8 numbers of the scheduler.py command line) -> weights tuple
+    values = [float(v) for v in text.replace(",", " ").split()]
+    if len(values) != 8:
+        raise ValueError(f"Expected 8 weights, got {len(values)}: {text}")
+    w_minfilled, w_pref, w_pair, w_secdiff, _, _, pen_notpaired, pen_section = values
+    return (w_minfilled, w_pref, w_pair, w_secdiff, pen_notpaired, pen_section)
+
+def prepare(path, weights, config):
+    # Parse and preprocess path once (per process). The greedy schedule is found under
+    # weights but is feasible under any.
+    if path in PREPARED:
+        return PREPARED[path]
+    random.seed(config["seed"])
+    with contextlib.redirect_stdout(io.StringIO()):
+        problem = load_problem(path)
+        initial_state, failure = build_initial_state(problem, weights, config["forward_check"], config["symmetry"])
+        greedy = None
+        if initial_state is not None:
+            solution, _ = find_initial_bound(initial_state, weights)
+            if solution:
+                greedy = list(solution.slot_of)
+    if initial_state is None:
+        PREPARED[path] = (None, failure, None)
+    else:
+        PREPARED[path] = (problem, initial_state, greedy)
+    return PREPARED[path]
+
+def reweighted_root(problem, initial_state, weights, forward_check):
+    # initial_state with its fixed assignments, costed under weights
+    root = state_from_slots(State(problem, weights=weights), initial_state.slot_of)
+    if forward_check:
+        root.init_domains()
+    return root
+
+def run_job(path, weights, incumbents, config):
+    # One Branch-and-Bound search: path under weights, starting from the cheapest of the
+    # incumbents (slot-index arrays) re-scored under weights
+    start_time = time.time()
+    problem, initial_state, greedy = prepare(path, weights, config)
+    if problem is None:
+        return {"warm_cost": None, "eval_value": None, "seconds": 0.0, "nodes_expanded": 0, "slot_of": None}
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        root = reweighted_root(problem, initial_state, weights, config["forward_check"])
+        plain_root = reweighted_root(problem, initial_state, weights, False)
+        best_solution, best_cost = None, float('inf')
+        for slot_of in incumbents:
+            solution = state_from_slots(plain_root, slot_of)
+            cost = final_cost(solution, weights)
+            if cost < best_cost:
+                best_solution, best_cost = solution, cost
+        warm_cost = best_cost
+
+        stats = {}
+        if config["strategy"] == "dfbnb":
+            solution, cost = depth_first_branch_and_bound(root, weights, best_solution, best_cost, config["timeout"],
+                                                          flow_bound=config["flow_bound"], stats=stats)
+        else:
+            solution, cost = branch_and_bound(root, weights, best_solution, best_cost, config["timeout"],
+                                              flow_bound=config["flow_bound"], stats=stats)
+
+    return {
+        "warm_cost": None if warm_cost == float('inf') else warm_cost,
+        "eval_value": int(cost) if solution else None,
+        "seconds": round(time.time() - start_time, 3),
+        "nodes_expanded": stats.get("nodes_expanded", 0),
+        "slot_of": list(solution.slot_of) if solution else None,
+    }
+
+def batch_solve(paths, weight_vectors, workers=1, config=None):
+    # Solve every instance in paths under every weights tuple in weight_vectors with a
+    # pool of workers processes. Returns [(path, weights, result)] in job order, result
+    # as returned by run_job (slot_of is the schedule's slot-index array).
+    if config is None:
+        config = {"seed": 0, "timeout": TIMEOUT_SECONDS, "forward_check": False, "strategy": "bestfirst",
+                  "symmetry": False, "flow_bound": False}
+    # Preprocess before the pool starts, so forked workers inherit PREPARED
+    incumbents = {}
+    for path in paths:
+        print(f"Preparing {path}...")
+        _, _, greedy = prepare(path, weight_vectors[0], config)
+        incumbents[path] = [greedy] if greedy is not None else []
+
+    jobs = [(path, weights) for path in paths for weights in weight_vectors]
+    results = {}
+    next_job = 0
+    running = {}
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context()) as pool:
+        while next_job < len(jobs) or running:
+            # Submit as workers free up, so each job starts from every schedule found so far
+            while next_job < len(jobs) and len(running) < workers:
+                path, weights = jobs[next_job]
+                future = pool.submit(run_job, path, weights, list(incumbents[path]), config)
+                running[future] = next_job
+                next_job += 1
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                k = running.pop(future)
+                path, weights = jobs[k]
+                result = future.result()
+                results[k] = result
+                if result["slot_of"] is not None and result["slot_of"] not in incumbents[path]:
+                    incumbents[path].append(result["slot_of"])
+                print(f"Done {os.path.basename(path)} {weights}: Eval-value {result['eval_value']} "
+                      f"in {result['seconds']}s")
+    return [(path, weights, results[k]) for k, (path, weights) in enumerate(jobs)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Solve many instances and/or weight vectors")
+    parser.add_argument("files", nargs="+", help="Input files")
+    parser.add_argument("--weights", action="append",
+                        help="The 8 weights of the scheduler.py command line, comma separated (repeat for a sweep)")
+    parser.add_argument("--weights-file", help="File with one weight vector (8 numbers) per line")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Number of worker processes")
+    parser.add_argument("--timeout", type=float, default=TIMEOUT_SECONDS, help="Branch-and-Bound time limit per job")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the greedy restarts")
+    parser.add_argument("--forward-check", action="store_true")
+    parser.add_argument("--strategy", choices=["bestfirst", "dfbnb"], default="bestfirst")
+    parser.add_argument("--symmetry", action="store_true")
+    parser.add_argument("--flow-bound", action="store_true")
+    parser.add_argument("--output", help="Write the results (with the schedules) as JSON to this file")
+    args = parser.parse_args()
+
+    weight_texts = list(args.weights or [])
+    if args.weights_file:
+        with open(args.weights_file) as f:
+            weight_texts += [line for line in f if line.strip() and not line.startswith("#")]
+    if not weight_texts:
+        weight_texts = ["1,1,1,1,1,1,1,1"]
+    weight_vectors = [parse_weights(text) for text in weight_texts]
+    config = {
+        "seed": args.seed,
+        "timeout": args.timeout,
+        "forward_check": args.forward_check,
+        "strategy": args.strategy,
+        "symmetry": args.symmetry,
+        "flow_bound": args.flow_bound,
+    }
+
+    rows = batch_solve(args.files, weight_vectors, args.workers, config)
+
+    print(f"{'Instance':<20} {'Weights':<32} {'Warm bound':>10} {'Eval':>8} {'Time (s)':>9} {'Nodes':>9}")
+    for path, weights, result in rows:
+        weights_text = ",".join(f"{w:g}" for w in weights)
+
+        def show(key):
+            value = result[key]
+            return "-" if value is None else f"{value:g}"
+        print(f"{os.path.basename(path):<20} {weights_text:<32} {show('warm_cost'):>10} {show('eval_value'):>8} "
+              f"{result['seconds']:>9.3f} {result['nodes_expanded']:>9}")
+
+    if args.output:
+        report = []
+        for path, weights, result in rows:
+            assignments = None
+            if result["slot_of"] is not None:
+                problem = PREPARED[path][0]
+                assignments = {problem.courses[i].id: problem.slots[s].id
+                               for i, s in enumerate(result["slot_of"]) if s >= 0}
+            entry = {key: value for key, value in result.items() if key != "slot_of"}
+            report.append({"instance": path, "weights": list(weights), **entry, "assignments": assignments})
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
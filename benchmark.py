@@ -0,0 +1,170 @@
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import random
+import sys
+import time
+from parser import parse_file
+from parallel import get_context
+from solver import solve
+
+try:
+    import resource
+except ImportError: # Not available on Windows: peak memory is not reported
+    resource = None
+
+# Instances run when none are given on the command line
+DEFAULT_PATTERNS = ["HC*.txt", "SC*.txt", "deptinst*.txt", "input*.txt"]
+# Weights used for every instance (same order as the scheduler.py arguments)
+BENCHMARK_WEIGHTS = (1, 1, 1, 1, 1, 1)
+# Time limit of the search per instance (seconds)
+BENCHMARK_TIMEOUT = 60
+# A run is flagged as slower when it takes this much longer than the baseline (relative)...
+TIME_TOLERANCE = 0.25
+# ...and at least this many seconds longer, so millisecond instances do not flap
+TIME_SLACK = 0.5
+
+def default_instances():
+    here = os.path.dirname(os.path.abspath(__file__))
+    paths = []
+    for pattern in DEFAULT_PATTERNS:
+        paths += sorted(glob.glob(os.path.join(here, pattern)))
+    return paths
+
+def run_instance(path, config, results):
+    # Worker process: solve one instance and put its metrics on results. Running every
+    # instance in its own process keeps the peak memory of each run separate.
+    random.seed(config["seed"])
+    with contextlib.redirect_stdout(io.StringIO()):
+        start_time = time.time()
+        problem = parse_file(path)
+        parsed_time = time.time()
+        stats = {}
+        result = solve(problem, BENCHMARK_WEIGHTS, forward_check=config["forward_check"], strategy=config["strategy"],
+                       symmetry=config["symmetry"], flow_bound=config["flow_bound"],
+                       timeout_seconds=config["timeout"], stats=stats)
+        end_time = time.time()
+
+    solution = result[0] if result else None
+    cost = result[1] if result else float('inf')
+    wall = end_time - parsed_time
+    nodes = stats.get("nodes_expanded", 0)
+    metrics = {
+        "parse_seconds": round(parsed_time - start_time, 4),
+        "wall_seconds": round(wall, 4),
+        "first_solution_seconds": None,
+        "nodes_expanded": nodes,
+        "nodes_per_second": round(nodes / wall, 1) if wall > 0 else None,
+        "peak_memory_mb": None,
+        "eval_value": int(cost) if solution else None,
+    }
+    if "first_solution_time" in stats:
+        metrics["first_solution_seconds"] = round(stats["first_solution_time"] - parsed_time, 4)
+    if resource is not None:
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+        metrics["peak_memory_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1)
+    results.put(metrics)
+
+def measure(path, config):
+    # Metrics of one instance, from a fresh process
+    ctx = get_context()
+    results = ctx.Queue()
+    p = ctx.Process(target=run_instance, args=(path, config, results))
+    p.start()
+    # The set-up before the search is not covered by its time limit, so allow extra time
+    limit = 2 * config["timeout"] + 120
+    try:
+        metrics = results.get(timeout=limit)
+    except Exception:
+        metrics = {"error": f"no result within {limit}s"}
+    p.join(timeout=5)
+    if p.is_alive():
+        p.terminate()
+    return metrics
+
+def compare(report, baseline):
+    # Regressions of report against baseline, as strings
+    regressions = []
+    if baseline.get("config") != report["config"]:
+        print("Warning: the baseline was recorded with a different configuration.")
+    for name, metrics in report["instances"].items():
+        old = baseline.get("instances", {}).get(name)
+        if old is None:
+            continue
+        if "error" in metrics and "error" not in old:
+            regressions.append(f"{name}: {metrics['error']}")
+            continue
+        if old.get("eval_value") is not None:
+            if metrics.get("eval_value") is None:
+                regressions.append(f"{name}: no solution (baseline Eval-value {old['eval_value']})")
+            elif metrics["eval_value"] > old["eval_value"]:
+                regressions.append(f"{name}: Eval-value {metrics['eval_value']} (baseline {old['eval_value']})")
+        if "wall_seconds" in metrics and "wall_seconds" in old:
+            new_time = metrics["wall_seconds"]
+            old_time = old["wall_seconds"]
+            if new_time > old_time * (1 + TIME_TOLERANCE) and new_time - old_time > TIME_SLACK:
+                regressions.append(f"{name}: {new_time:.2f}s (baseline {old_time:.2f}s)")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scheduler on the bundled instances")
+    parser.add_argument("files", nargs="*", help="Input files (default: the bundled HC*, SC*, deptinst* and input* files)")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON file from an earlier --output run to compare against")
+    parser.add_argument("--timeout", type=float, default=BENCHMARK_TIMEOUT, help="Time limit of the search per instance")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the restarts")
+    parser.add_argument("--forward-check", action="store_true")
+    parser.add_argument("--strategy", choices=["bestfirst", "dfbnb"], default="bestfirst")
+    parser.add_argument("--symmetry", action="store_true")
+    parser.add_argument("--flow-bound", action="store_true")
+    args = parser.parse_args()
+
+    config = {
+        "weights": list(BENCHMARK_WEIGHTS),
+        "seed": args.seed,
+        "timeout": args.timeout,
+        "forward_check": args.forward_check,
+        "strategy": args.strategy,
+        "symmetry": args.symmetry,
+        "flow_bound": args.flow_bound,
+    }
+    paths = args.files or default_instances()
+    report = {"config": config, "instances": {}}
+
+    print(f"{'Instance':<20} {'Eval':>8} {'Time (s)':>10} {'First (s)':>10} {'Nodes':>9} {'Nodes/s':>10} {'Peak MB':>8}")
+    for path in paths:
+        name = os.path.basename(path)
+        metrics = measure(path, config)
+        report["instances"][name] = metrics
+        if "error" in metrics:
+            print(f"{name:<20} {metrics['error']}")
+            continue
+
+        def show(key):
+            value = metrics[key]
+            return "-" if value is None else value
+        print(f"{name:<20} {show('eval_value'):>8} {metrics['wall_seconds']:>10.3f} {show('first_solution_seconds'):>10} "
+              f"{metrics['nodes_expanded']:>9} {show('nodes_per_second'):>10} {show('peak_memory_mb'):>8}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline)
+        if regressions:
+            print(f"{len(regressions)} regressions against {args.baseline}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+import itertools
+from collections import defaultdict
+import state as state_module
+
+# Stronger (and slower) lower bound on the remaining cost of a partial schedule, used by
+# the Branch-and-Bound engines only when the cheap State.heuristic() fails to prune a node.
+
+# --check-cost: transport_cost is checked against brute_force_transport when the number
+# of placements to enumerate is at most this
+BRUTE_FORCE_LIMIT = 20000
+
+def live_costs(state, course):
+    # slot index -> cost_delta of course in that slot, over the slots it can still take
+    if state.domains is not None:
+        slots = state.domain_slots(course)
+    else:
+        slots = [s for s in state.problem.valid_slots[course] if state.is_valid(course, s)]
+    return {s.index: state.cost_delta(course, s) for s in slots}
+
+def transport_cost(state, offset, costs):
+    # Min-cost assignment of courses (costs: one {slot index: cost} per course) to slots,
+    # slot s taking at most lecture_max minus its usage counter at offset.
+    # Starts with every course in its cheapest slot, which is optimal if capacities are
+    # ignored (moving a course never costs less than 0), then moves the overflow out of
+    # overloaded slots along shortest paths. Returns float('inf') if the courses do not fit.
+    slots = state.problem.slots
+    usage = state.usage
+    at = []
+    load = defaultdict(int)
+    total = 0
+    for c in costs:
+        s = min(c, key=c.get)
+        at.append(s)
+        load[s] += 1
+        total += c[s]
+
+    def room(s):
+        return slots[s].lecture_max - usage[3 * s + offset] - load[s]
+
+    while True:
+        excess = [s for s in list(load) if room(s) < 0]
+        if not excess:
+            return total
+        # Bellman-Ford from the overloaded slots: dist[b] is the cheapest way to push one
+        # course out of some overloaded slot into b (possibly bumping others on the way)
+        dist = {s: 0 for s in excess}
+        via = {}
+        changed = True
+        while changed:
+            changed = False
+            for k, c in enumerate(costs):
+                a = at[k]
+                if a not in dist:
+                    continue
+                base = dist[a] - c[a]
+                for b, cost in c.items():
+                    d = base + cost
+                    if d < dist.get(b, float('inf')) - 1e-9:
+                        dist[b] = d
+                        via[b] = (k, a)
+                        changed = True
+        targets = [b for b in dist if room(b) > 0]
+        if not targets:
+            return float('inf')
+        b = min(targets, key=dist.get)
+        total += dist[b]
+        while b in via:
+            k, a = via[b]
+            at[k] = b
+            load[a] -= 1
+            load[b] += 1
+            b = a
+
+def brute_force_transport(state, offset, costs):
+    # transport_cost by trying every placement of the courses (for --check-cost)
+    slots = state.problem.slots
+    usage = state.usage
+    best = float('inf')
+    for placement in itertools.product(*(list(c) for c in costs)):
+        load = defaultdict(int)
+        for s in placement:
+            load[s] += 1
+        if all(load[s] <= slots[s].lecture_max - usage[3 * s + offset] for s in load):
+            best = min(best, sum(c[s] for c, s in zip(costs, placement)))
+    return best
+
+def prod_size(costs):
+    # Number of placements brute_force_transport would try
+    n = 1
+    for c in costs:
+        n *= len(c)
+        if n > BRUTE_FORCE_LIMIT:
+            break
+    return n
+
+def minfilled_bound(state):
+    # MinFilled penalty every completion pays: slots already in use that stay under
+    # lecture_min even if every unassigned course that can use them goes there. Unlike
+    # State.h_minfilled, empty slots are not charged, since they may stay empty.
+    total = 0
+    for slot in state.problem.slots:
+        if state.slot_total(slot) > 0:
+            total += state.slot_shortfall(slot)
+    return total
+
+def unavoidable_penalties(state, domains):
+    # Pair and SecDiff penalties between two unassigned courses that no choice of their
+    # slots (domains: course index -> bitmask of slot indices) can avoid
+    problem = state.problem
+    overlap_masks = problem.overlap_masks
+    w_pair, w_secdiff, pen_notpaired, pen_section = state.weights[2:6]
+
+    def reach(dom):
+        # Slots overlapping some slot of dom
+        mask = 0
+        while dom:
+            low = dom & -dom
+            mask |= overlap_masks[low.bit_length() - 1]
+            dom ^= low
+        return mask
+
+    penalty = 0
+    for c1, c2 in problem.pairs:
+        d1 = domains.get(c1.index)
+        d2 = domains.get(c2.index)
+        if d1 is not None and d2 is not None and not reach(d1) & d2:
+            penalty += pen_notpaired * w_pair
+    for group in problem.sections.values():
+        group = [c for c in group if c.index in domains]
+        for k, c1 in enumerate(group):
+            d1 = domains[c1.index]
+            for c2 in group[k + 1:]:
+                # Unavoidable if every slot of c1 overlaps every slot of c2
+                d2 = domains[c2.index]
+                dom = d1
+                forced = True
+                while dom and forced:
+                    low = dom & -dom
+                    if d2 & ~overlap_masks[low.bit_length() - 1]:
+                        forced = False
+                    dom ^= low
+                if forced:
+                    penalty += pen_section * w_secdiff
+    return penalty
+
+def assignment_bound(state):
+    # Admissible bound on the remaining cost: the MinFilled penalty of the slots in use
+    # (minfilled_bound), plus a min-cost assignment of the unassigned courses to slots with
+    # their remaining capacities (each course charged its preferences, pairs and SecDiff
+    # against the assigned courses), plus the unavoidable penalties among the unassigned
+    # courses. float('inf') if the unassigned courses cannot all be placed.
+    by_type = defaultdict(list)
+    domains = {}
+    for course in state.get_unassigned_courses():
+        costs = live_costs(state, course)
+        if not costs:
+            return float('inf')
+        by_type[course.usage_offset].append(costs)
+        dom = 0
+        for s in costs:
+            dom |= 1 << s
+        domains[course.index] = dom
+
+    h = minfilled_bound(state) * state.weights[0]
+    for offset, costs in by_type.items():
+        cost = transport_cost(state, offset, costs)
+        if state_module.DEBUG_COST_CHECK and prod_size(costs) <= BRUTE_FORCE_LIMIT:
+            exact = brute_force_transport(state, offset, costs)
+            assert cost == exact or abs(cost - exact) < 1e-6, f"Transport cost {cost} vs brute force {exact}"
+        h += cost
+        if h == float('inf'):
+            return h
+    return h + unavoidable_penalties(state, domains)
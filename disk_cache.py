@@ -0,0 +1,61 @@
+import hashlib
+import os
+
+# Files shared by the on-disk caches (parser.load_problem, solution_cache): their
+# directory, versions derived from the source code, atomic writes and LRU eviction.
+
+CACHE_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".scheduler_cache")
+
+def source_version(filenames):
+    # Hash of the source files filenames (next to this module)
+    digest = hashlib.sha256()
+    here = os.path.dirname(os.path.abspath(__file__))
+    for filename in filenames:
+        with open(os.path.join(here, filename), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def write_atomic(path, write):
+    # Create path's directory and call write(f) on a temporary file, then move it into
+    # place so a concurrent reader never sees half a file. Returns False if the location
+    # is read-only (the caller then runs without the cache).
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(temp_path, "wb") as f:
+            write(f)
+        os.replace(temp_path, path)
+    except OSError:
+        return False
+    return True
+
+def touch(path):
+    # Mark path as recently used for evict()
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+def evict(directory, max_bytes):
+    # Delete the least recently used files of directory until it fits in max_bytes
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    files = []
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            info = os.stat(path)
+        except OSError:
+            continue
+        files.append((info.st_mtime, info.st_size, path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
@@ -0,0 +1,154 @@
+import time
+import metrics
+from solver import GREEDY_NODE_LIMIT, branch_and_bound, build_initial_state, final_cost, find_initial_bound, state_from_slots
+
+# Incremental re-solve: start from the schedule of an earlier run (its scheduler.py output)
+# on a slightly different input. Every previous assignment that is still valid is kept;
+# only the courses that lost their slot, and those whose constraints changed, are freed
+# together with their constraint-graph neighbours up to a radius, and re-solved by
+# Branch-and-Bound with the rest fixed. If the freed courses cannot be placed, the
+# radius grows until they can (at worst every course is freed).
+
+# Default time budget of the repair search (seconds)
+INCREMENTAL_SECONDS = 30
+# Default radius (in constraint-graph hops) freed around each course to repair
+INCREMENTAL_RADIUS = 1
+
+def read_schedule(filename):
+    # Course id -> slot id from a scheduler.py output ("CPSC 433 LEC 01 : MO, 8:00"
+    # lines; everything else, e.g. the progress output and "Eval-value:", is skipped).
+    # Also returns the Eval-value printed there (or None).
+    schedule = {}
+    eval_value = None
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("Eval-value:"):
+                eval_value = float(line.split(":", 1)[1])
+            elif " : " in line:
+                course_id, slot_id = line.split(" : ", 1)
+                schedule[course_id.strip()] = slot_id.strip()
+    return schedule, eval_value
+
+def course_signature(problem, course):
+    # Everything the input says about course, comparable across two parses
+    return (
+        course.al_required,
+        sorted(problem.unwanted.get(course, ())),
+        sorted(problem.preferences.get(course, ())),
+        sorted(c.id for c in problem.incompatible_map.get(course, ())),
+        sorted(c.id for c in problem.pair_map.get(course, ())),
+        problem.partial_assignments.get(course),
+    )
+
+def changed_courses(old_problem, problem, schedule):
+    # Courses of problem whose constraints or preferences differ from old_problem, that
+    # are new, or that were scheduled in a slot whose capacities changed
+    changed = set()
+    changed_slots = set()
+    for slot in problem.slots:
+        old_slot = old_problem.get_slot(slot.id, slot.slot_type)
+        if old_slot is None or (old_slot.lecture_max, old_slot.lecture_min, old_slot.al_max) != \
+                (slot.lecture_max, slot.lecture_min, slot.al_max):
+            changed_slots.add((slot.id, slot.slot_type))
+    for course in problem.courses:
+        old_course = old_problem.get_course(course.id)
+        if old_course is None or course_signature(old_problem, old_course) != course_signature(problem, course):
+            changed.add(course)
+        elif (schedule.get(course.id), "LEC" if course.type == "LEC" else "TUT") in changed_slots:
+            changed.add(course)
+    return changed
+
+def keep_previous(initial_state, schedule):
+    # initial_state plus every assignment of schedule that is still valid, in course order.
+    # Returns (state, courses left unassigned).
+    problem = initial_state.problem
+    state = initial_state.copy()
+    state.domains = None
+    lost = []
+    for course in problem.courses:
+        if state.slot_of[course.index] >= 0:
+            continue
+        slot_id = schedule.get(course.id)
+        slot = None
+        if slot_id is not None:
+            slot = problem.get_slot(slot_id, "LEC" if course.type == "LEC" else "TUT")
+        # valid_slots also drops the slots propagation proved no schedule can use
+        if slot is None or slot not in problem.valid_slots[course] or not state.is_valid(course, slot):
+            lost.append(course)
+            continue
+        state = state.assign(course, slot)
+    return state, lost
+
+def neighbourhood(problem, seeds, radius, movable):
+    # Course indices of movable within radius hops of seeds in the constraint graph
+    freed = set(c.index for c in seeds)
+    frontier = list(freed)
+    for _ in range(radius):
+        next_frontier = []
+        for i in frontier:
+            for j in problem.neighbours[i]:
+                if j in movable and j not in freed:
+                    freed.add(j)
+                    next_frontier.append(j)
+        frontier = next_frontier
+    return freed
+
+def incremental_solve(problem, weights, schedule, old_problem=None, forward_check=False, radius=INCREMENTAL_RADIUS,
+                      time_budget=INCREMENTAL_SECONDS, node_limit=None, greedy_node_limit=GREEDY_NODE_LIMIT,
+                      on_solution=None):
+    # Re-solve problem starting from schedule (course id -> slot id, see read_schedule).
+    # old_problem: optional parse of the input schedule was made for; courses whose data
+    # changed are re-solved too even if their slot is still valid.
+    # node_limit (of the repair Branch-and-Bound), greedy_node_limit and on_solution are as
+    # in solver.solve. Returns (best_solution, best_cost) like solve.
+    start_time = time.time()
+    # No symmetry breaking: the kept assignments need not be in its canonical order
+    initial_state, failure = build_initial_state(problem, weights, forward_check)
+    if initial_state is None:
+        return failure
+
+    kept, lost = keep_previous(initial_state, schedule)
+    movable = set(c.index for c in problem.courses if initial_state.slot_of[c.index] < 0)
+    seeds = set(lost)
+    if old_problem is not None:
+        seeds |= set(c for c in changed_courses(old_problem, problem, schedule) if c.index in movable)
+    print(f"Kept {kept.n_assigned - initial_state.n_assigned} of {len(movable)} previous assignments; "
+          f"{len(lost)} lost their slot, {len(seeds) - len(lost)} more changed.")
+
+    best_solution, best_cost = None, float('inf')
+    if not lost:
+        # The previous schedule is still complete and valid: its cost is the bound to beat
+        best_solution, best_cost = kept, final_cost(kept, weights)
+        print(f"Previous schedule is still valid, cost {best_cost}.")
+        if metrics.RECORDER is not None:
+            metrics.RECORDER.incumbent(best_cost, "previous schedule")
+        if on_solution is not None and on_solution(best_cost, best_solution):
+            print("Search stopped by the solution callback.")
+            return best_solution, best_cost
+    if not seeds:
+        return best_solution, best_cost
+
+    while True:
+        freed = neighbourhood(problem, seeds, radius, movable)
+        slot_of = list(kept.slot_of)
+        for i in freed:
+            slot_of[i] = -1
+        sub_root = state_from_slots(initial_state, slot_of)
+        print(f"Repairing {len(freed)} courses (radius {radius})...")
+        if best_solution is None:
+            solution, cost = find_initial_bound(sub_root, weights, greedy_node_limit,
+                                                deadline=start_time + time_budget)
+            if solution is not None:
+                best_solution, best_cost = solution, cost
+                if on_solution is not None and on_solution(best_cost, best_solution):
+                    print("Search stopped by the solution callback.")
+                    return best_solution, best_cost
+        # Every course freed (or out of time): as in solve, Branch-and-Bound without a bound
+        if best_solution is not None or len(freed) == len(movable) or time.time() - start_time >= time_budget:
+            break
+        radius += 1
+
+    remaining = max(0.0, time_budget - (time.time() - start_time))
+    return branch_and_bound(sub_root, weights, best_solution, best_cost, round(remaining, 2), node_limit=node_limit,
+                            on_solution=on_solution)
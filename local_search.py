@@ -0,0 +1,272 @@
+import math
+import random
+import time
+import state as state_module
+import metrics
+from solver import (GREEDY_NODE_LIMIT, branch_and_bound, build_initial_state, find_initial_bound, final_cost,
+                    state_from_slots)
+
+# Default time budget of the local search (seconds)
+LOCAL_SEARCH_SECONDS = 60
+# Iterations a moved course stays tabu (unless moving it gives a new best schedule)
+TABU_TENURE = 10
+# Share of neighbours that are single-course moves (the rest are swaps)
+MOVE_PROBABILITY = 0.5
+# Annealing temperature at the end of the budget, relative to the start
+FINAL_TEMPERATURE_RATIO = 0.001
+# LNS: courses freed per iteration at the start (adapted as the search goes) and its limits
+LNS_NEIGHBOURHOOD = 8
+LNS_MIN_NEIGHBOURHOOD = 3
+LNS_MAX_NEIGHBOURHOOD = 40
+# LNS: Branch-and-Bound time limit per sub-problem (seconds)
+LNS_ITERATION_SECONDS = 2
+
+def slot_penalty(state, slot, w_minfilled):
+    # MinFilled penalty of one slot in a complete schedule (see State.calculate_minfilled_cost)
+    total = state.slot_total(slot)
+    if 0 < total < slot.lecture_min:
+        return (slot.lecture_min - total) * w_minfilled
+    return 0
+
+def try_move(state, course, slot):
+    # course -> slot in place. Returns the number of trail frames to undo on rejection,
+    # or None if the move is invalid (and already undone).
+    state.unassign(course)
+    if not state.is_valid(course, slot):
+        state.undo()
+        return None
+    state.apply(course, slot)
+    return 2
+
+def try_swap(state, c1, c2):
+    # Exchange the slots of c1 and c2 in place, same contract as try_move
+    slots = state.problem.slots
+    s1 = slots[state.slot_of[c1.index]]
+    s2 = slots[state.slot_of[c2.index]]
+    state.unassign(c1)
+    state.unassign(c2)
+    if not state.is_valid(c1, s2):
+        state.undo()
+        state.undo()
+        return None
+    state.apply(c1, s2)
+    if not state.is_valid(c2, s1):
+        for _ in range(3):
+            state.undo()
+        return None
+    state.apply(c2, s1)
+    return 4
+
+def local_search(initial_state, solution, weights, time_budget=LOCAL_SEARCH_SECONDS, seed=0, on_solution=None):
+    # Simulated annealing with a short tabu list over move (one course to another slot)
+    # and swap (two courses exchange slots) neighbours of a complete schedule.
+    # Courses fixed in initial_state (partial assignments, special tutorials) never move.
+    # on_solution: optional callback as in solver.solve, called with every improvement.
+    # Returns (best_solution, best_cost, curve) where curve lists (seconds, cost) per improvement.
+    rng = random.Random(seed)
+    problem = initial_state.problem
+    w_minfilled = weights[0]
+    movable = [c for c in problem.courses if initial_state.slot_of[c.index] < 0]
+    valid_sets = {c: frozenset(s.index for s in problem.valid_slots[c]) for c in movable}
+    by_kind = {True: [c for c in movable if c.type == "LEC"], False: [c for c in movable if c.type != "LEC"]}
+
+    state = solution.copy(trail=[])
+    state.domains = None
+    current = final_cost(state, weights)
+    best_solution, best_cost = solution, current
+    start_time = time.time()
+    curve = [(0.0, best_cost)]
+    print(f"Starting local search from cost {best_cost} ({time_budget}s budget)...")
+    if not movable or best_cost == 0:
+        return best_solution, best_cost, curve
+
+    temperature0 = max(1.0, 0.05 * current)
+    tabu_until = {}
+    iteration = 0
+    accepted = 0
+    slots = problem.slots
+
+    while True:
+        elapsed = time.time() - start_time
+        if elapsed >= time_budget:
+            break
+        iteration += 1
+        temperature = temperature0 * FINAL_TEMPERATURE_RATIO ** (elapsed / time_budget)
+
+        course = rng.choice(movable)
+        si = state.slot_of[course.index]
+        if rng.random() < MOVE_PROBABILITY:
+            target = rng.choice(problem.valid_slots[course])
+            if target.index == si:
+                continue
+            moved = (course,)
+            affected = (slots[si], target)
+        else:
+            other = rng.choice(by_kind[course.type == "LEC"])
+            sj = state.slot_of[other.index]
+            if sj == si or sj not in valid_sets[course] or si not in valid_sets[other]:
+                continue
+            moved = (course, other)
+            affected = (slots[si], slots[sj])
+
+        # MinFilled only changes in the two slots involved
+        before = state.cost + sum(slot_penalty(state, s, w_minfilled) for s in affected)
+        if len(moved) == 1:
+            frames = try_move(state, course, target)
+        else:
+            frames = try_swap(state, course, other)
+        if frames is None:
+            continue
+        after = state.cost + sum(slot_penalty(state, s, w_minfilled) for s in affected)
+        delta = after - before
+        new_cost = current + delta
+
+        is_tabu = any(tabu_until.get(c, 0) > iteration for c in moved)
+        if is_tabu and new_cost >= best_cost:
+            reject = True
+        elif delta <= 0:
+            reject = False
+        else:
+            reject = rng.random() >= math.exp(-delta / temperature)
+        if reject:
+            for _ in range(frames):
+                state.undo()
+            continue
+
+        # Accepted: the trail is only needed until the decision is made
+        state.trail.clear()
+        accepted += 1
+        current = new_cost
+        if state_module.DEBUG_COST_CHECK:
+            full = final_cost(state, weights)
+            assert abs(full - current) < 1e-6, f"Local search cost mismatch: incremental {current} vs full {full}"
+        for c in moved:
+            tabu_until[c] = iteration + TABU_TENURE
+        if current < best_cost - 1e-9:
+            best_cost = current
+            best_solution = state.copy()
+            curve.append((time.time() - start_time, best_cost))
+            print(f"Local search: {curve[-1][0]:.2f}s, cost {best_cost}")
+            if metrics.RECORDER is not None:
+                metrics.RECORDER.incumbent(best_cost, "local search")
+            if on_solution is not None and on_solution(best_cost, best_solution):
+                print("Search stopped by the solution callback.")
+                break
+            if best_cost == 0:
+                break
+
+    print(f"Local search finished: {iteration} iterations, {accepted} accepted moves, best cost {best_cost}")
+    return best_solution, best_cost, curve
+
+def pick_neighbourhood(rng, solution, movable, k):
+    # Up to k courses to free: those on one day, in one department, or a cluster of
+    # constraint-graph neighbours around a random course. Returns (description, courses).
+    problem = solution.problem
+    slots = problem.slots
+    slot_of = solution.slot_of
+    kind = rng.choice(("day", "department", "cluster"))
+    if kind == "day":
+        day = rng.choice(sorted({s.day for s in slots}))
+        kind = f"day {day}"
+        pool = [c for c in movable if slots[slot_of[c.index]].day == day]
+    elif kind == "department":
+        dept = rng.choice(sorted({c.dept for c in movable}))
+        kind = f"department {dept}"
+        pool = [c for c in movable if c.dept == dept]
+    else:
+        # Breadth-first from a random course; fill up at random if its component is small
+        is_movable = set(c.index for c in movable)
+        seed = rng.choice(movable)
+        kind = f"cluster around {seed.id}"
+        seen = {seed.index}
+        queue = [seed.index]
+        for i in queue:
+            if len(queue) >= k:
+                break
+            for j in problem.neighbours[i]:
+                if j in is_movable and j not in seen:
+                    seen.add(j)
+                    queue.append(j)
+        pool = [problem.courses[i] for i in queue[:k]]
+        rest = [c for c in movable if c.index not in seen]
+        pool += rng.sample(rest, min(len(rest), k - len(pool)))
+    if len(pool) > k:
+        pool = rng.sample(pool, k)
+    return kind, pool
+
+def large_neighbourhood_search(initial_state, solution, weights, time_budget=LOCAL_SEARCH_SECONDS, seed=0, on_solution=None):
+    # Repeatedly keep the best schedule except for a neighbourhood of k courses, and
+    # re-solve those exactly with branch_and_bound under LNS_ITERATION_SECONDS.
+    # k grows while sub-problems are solved to completion (stats["complete"]) and shrinks
+    # when they time out.
+    # on_solution and the result are as in local_search.
+    rng = random.Random(seed)
+    problem = initial_state.problem
+    movable = [c for c in problem.courses if initial_state.slot_of[c.index] < 0]
+    best_solution, best_cost = solution, final_cost(solution, weights)
+    start_time = time.time()
+    curve = [(0.0, best_cost)]
+    print(f"Starting large neighbourhood search from cost {best_cost} ({time_budget}s budget)...")
+    if not movable or best_cost == 0:
+        return best_solution, best_cost, curve
+
+    k = LNS_NEIGHBOURHOOD
+    iteration = 0
+    while time.time() - start_time < time_budget:
+        iteration += 1
+        kind, freed = pick_neighbourhood(rng, best_solution, movable, k)
+        if not freed:
+            continue
+        slot_of = list(best_solution.slot_of)
+        for course in freed:
+            slot_of[course.index] = -1
+        sub_root = state_from_slots(initial_state, slot_of)
+
+        remaining = time_budget - (time.time() - start_time)
+        timeout = min(LNS_ITERATION_SECONDS, remaining)
+        stats = {}
+        solution, cost = branch_and_bound(sub_root, weights, best_solution, best_cost, timeout, quiet=True, stats=stats)
+
+        if cost < best_cost - 1e-9:
+            best_solution, best_cost = solution, cost
+            curve.append((time.time() - start_time, best_cost))
+            print(f"LNS: {curve[-1][0]:.2f}s, cost {best_cost} (freed {len(freed)} courses, {kind})")
+            if metrics.RECORDER is not None:
+                metrics.RECORDER.incumbent(best_cost, "large neighbourhood search")
+            if on_solution is not None and on_solution(best_cost, best_solution):
+                print("Search stopped by the solution callback.")
+                break
+            if best_cost == 0:
+                break
+        if stats["complete"]:
+            k = min(k + 1, LNS_MAX_NEIGHBOURHOOD, len(movable))
+        else:
+            k = max(k - 1, LNS_MIN_NEIGHBOURHOOD)
+
+    print(f"Large neighbourhood search finished: {iteration} iterations, final neighbourhood size {k}, best cost {best_cost}")
+    return best_solution, best_cost, curve
+
+def improve_solve(problem, weights, method="local", forward_check=False, symmetry=False, time_budget=LOCAL_SEARCH_SECONDS,
+                  greedy_node_limit=GREEDY_NODE_LIMIT, on_solution=None):
+    # solver.solve with the Branch-and-Bound phase replaced by an improvement search from
+    # the greedy schedule: "local" (local_search) or "lns" (large_neighbourhood_search).
+    # time_budget covers the whole call, the greedy DFS included.
+    # greedy_node_limit and on_solution are as in solver.solve.
+    # Returns (best_solution, best_cost, curve).
+    start_time = time.time()
+    deadline = start_time + time_budget
+    initial_state, failure = build_initial_state(problem, weights, forward_check, symmetry)
+    if initial_state is None:
+        return failure
+
+    best_solution, best_cost = find_initial_bound(initial_state, weights, greedy_node_limit, deadline)
+    if best_solution is None:
+        print("No initial solution to improve.")
+        return None, float('inf'), []
+    if on_solution is not None and on_solution(best_cost, best_solution):
+        print("Search stopped by the solution callback.")
+        return best_solution, best_cost, [(0.0, best_cost)]
+    remaining = max(0.0, deadline - time.time())
+    if method == "lns":
+        return large_neighbourhood_search(initial_state, best_solution, weights, remaining, on_solution=on_solution)
+    return local_search(initial_state, best_solution, weights, remaining, on_solution=on_solution)
@@ -0,0 +1,142 @@
+import contextlib
+import cProfile
+import io
+import json
+import pstats
+import time
+import tracemalloc
+from collections import defaultdict
+
+# Search instrumentation, off by default. enable() swaps counting/timing wrappers into
+# the hot functions (State.is_valid, State.cost_delta, solver.heuristic) and sets RECORDER,
+# which the search loops read once per call and check with `is not None` per node.
+# disable() puts the original functions back, so a run without metrics pays nothing.
+# Only the main process is measured (not the --workers/--portfolio processes).
+
+RECORDER = None
+# Functions replaced by enable(): (owner, attribute name) -> original
+originals = {}
+
+class Recorder:
+    def __init__(self):
+        self.start_time = time.time()
+        self.counters = defaultdict(int)
+        self.timers = defaultdict(float) # seconds spent per timed function
+        self.events = [] # (seconds since start, kind, fields)
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def event(self, kind, **fields):
+        self.events.append((time.time() - self.start_time, kind, fields))
+
+    def incumbent(self, cost, source):
+        # A new best schedule
+        self.count("incumbents")
+        self.event("incumbent", cost=cost, source=source)
+
+    def summary(self):
+        return {
+            "seconds": round(time.time() - self.start_time, 4),
+            "counters": dict(sorted(self.counters.items())),
+            "timers": {name: round(t, 4) for name, t in sorted(self.timers.items())},
+        }
+
+    def write_jsonl(self, path):
+        # One line per event, then the summary
+        with open(path, "w") as f:
+            for t, kind, fields in self.events:
+                f.write(json.dumps({"t": round(t, 4), "event": kind, **fields}) + "\n")
+            f.write(json.dumps({"event": "summary", **self.summary()}) + "\n")
+
+    def print_summary(self):
+        summary = self.summary()
+        print(f"Search metrics ({summary['seconds']}s):")
+        for name, value in summary["counters"].items():
+            print(f"  {name}: {value}")
+        for name, value in summary["timers"].items():
+            print(f"  {name} time: {value}s")
+
+def counted_is_valid(is_valid):
+    # Count calls and, for invalid values, the constraint that ruled them out
+    from propagation import invalid_constraint
+
+    def wrapper(self, course, slot):
+        recorder = RECORDER
+        recorder.counters["is_valid calls"] += 1
+        if is_valid(self, course, slot):
+            return True
+        constraint, _ = invalid_constraint(self, course, slot)
+        recorder.counters[f"invalid: {constraint}"] += 1
+        return False
+    return wrapper
+
+def timed(func, name):
+    def wrapper(*args):
+        start = time.perf_counter()
+        result = func(*args)
+        recorder = RECORDER
+        recorder.timers[name] += time.perf_counter() - start
+        recorder.counters[f"{name} calls"] += 1
+        return result
+    return wrapper
+
+def replace(owner, name, wrapper):
+    original = getattr(owner, name)
+    originals[(owner, name)] = original
+    setattr(owner, name, wrapper(original))
+
+def enable():
+    # Start recording. Returns the Recorder.
+    global RECORDER
+    import solver
+    from state import State
+    if RECORDER is not None:
+        return RECORDER
+    RECORDER = Recorder()
+    replace(State, "is_valid", counted_is_valid)
+    replace(State, "cost_delta", lambda f: timed(f, "cost_delta"))
+    replace(solver, "heuristic", lambda f: timed(f, "heuristic"))
+    return RECORDER
+
+def disable():
+    # Stop recording and restore the original functions. Returns the Recorder (or None).
+    global RECORDER
+    recorder = RECORDER
+    for (owner, name), original in originals.items():
+        setattr(owner, name, original)
+    originals.clear()
+    RECORDER = None
+    return recorder
+
+@contextlib.contextmanager
+def profiling(profile_path=None, trace_memory=False, top=25):
+    # Run the body under cProfile (profile_path: also save the raw stats there, for
+    # pstats/snakeviz) and/or tracemalloc, and print the top entries afterwards.
+    # profile_path="" profiles without saving.
+    profiler = cProfile.Profile() if profile_path is not None else None
+    if trace_memory:
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        if profiler is not None:
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(top)
+            print(out.getvalue())
+            if profile_path:
+                profiler.dump_stats(profile_path)
+                print(f"Profile written to {profile_path}")
+        if trace_memory:
+            print(f"Peak traced memory: {peak / (1024 * 1024):.1f} MB")
+            print("Largest allocation sites still live at the end:")
+            for stat in snapshot.statistics("lineno")[:top]:
+                print(f"  {stat}")
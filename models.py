@@ -1,6 +1,20 @@
 from collections import defaultdict
 
+# CPSC 351/413 must not overlap the special tutorials CPSC 851/913
+SPECIAL_PARTNERS = {351: 851, 413: 913}
+
+# Offset of each course type inside a slot's block of usage counters (see State.usage)
+USAGE_OFFSET = {'LEC': 0, 'TUT': 1, 'LAB': 2}
+
 class Course:
+    # Courses and slots are the keys of the per-course/per-slot dicts and sets of
+    # ProblemInstance. Each is created once per ProblemInstance and looked up by id
+    # through courses_by_id/slots_by_id, so they hash and compare by identity (the
+    # object defaults, no Python-level __hash__/__eq__ per dict access).
+    __slots__ = ('id', 'al_required', 'dept', 'number', 'type', 'section', 'index', 'time_groups', 'avoid_groups',
+                 'parent', 'unwanted_slots', 'twins_before', 'twins_after', 'is_500_level', 'is_evening',
+                 'parent_id', 'section_key', 'usage_offset')
+
     def __init__(self, line):
         # Format: "CPSC 433 LEC 01" or "CPSC 433 LEC 01 TUT 01"
         parts = line.strip().split(',')
@@ -35,8 +49,25 @@ class Course:
             elif "LAB" in self.id:
                 self.type = "LAB"
         
+        # Dense index, set when the course is added to a ProblemInstance
+        self.index = -1
+        # Time groups (see ProblemInstance.add_course): groups whose occupied time this
+        # course adds to, and groups whose occupied time it must not overlap
+        self.time_groups = ()
+        self.avoid_groups = ()
+        # Resolved by ProblemInstance.precompute_constraint_indexes
+        self.parent = None # parent lecture (Course) of a tutorial
+        self.unwanted_slots = frozenset() # slot indices
+        # Interchangeable courses (precompute_symmetries): indices of the courses of the
+        # same class before / after this one, whose slots must not come after / before its own
+        self.twins_before = ()
+        self.twins_after = ()
+
         self.is_500_level = (self.number // 100 == 5)
         self.is_evening = self.section.startswith('9')
+        # Key of ProblemInstance.sections (SecDiff) and offset of the type in State.usage
+        self.section_key = (self.dept, self.number, self.type)
+        self.usage_offset = USAGE_OFFSET[self.type]
         
         # For linking Lecture and Tutorial (No Overlap constraint)
         # Parent lecture ID: "CPSC 433 LEC 01 TUT 01" -> "CPSC 433 LEC 01"
@@ -52,16 +83,14 @@ class Course:
     def __repr__(self):
         return self.id
 
-    def __hash__(self):
-        return hash(self.id)
-
-    def __eq__(self, other):
-        return self.id == other.id
-    
     def __lt__(self, other):
         return self.id < other.id
 
 class Slot:
+    # Identity hashing as for Course
+    __slots__ = ('day', 'time', 'id', 'slot_type', 'index', 'time_mask', 'lecture_max', 'lecture_min', 'al_max',
+                 'hour', 'minute', 'start_min', 'duration', 'end_min', 'atomic_slots', 'is_evening', 'no_lectures')
+
     def __init__(self, line, slot_type):
         # Format: "MO, 8:00, 3,2,1"
         parts = line.strip().split(',')
@@ -69,6 +98,10 @@ class Slot:
         self.time = parts[1].strip()
         self.id = f"{self.day}, {self.time}"
         self.slot_type = slot_type # "LEC" or "TUT"
+        # Dense index, set when the slot is added to a ProblemInstance
+        self.index = -1
+        # Bitmask of day x time atoms, set by ProblemInstance.precompute_overlaps
+        self.time_mask = None
         
         # Parse capacities
         # Assumption: LectureMax, LabMax, MinFilled
@@ -98,6 +131,10 @@ class Slot:
         self.hour = int(time_parts[0])
         self.minute = int(time_parts[1])
         self.start_min = self.hour * 60 + self.minute
+        # Evening slot (evening sections may only use these) and the Tuesday 11:00
+        # slot (no lectures), checked by is_valid
+        self.is_evening = self.hour >= 18
+        self.no_lectures = self.day == "TU" and self.hour == 11 and self.minute == 0
         
         # Determine Duration
         # Standard UofC: MWF = 60 mins (50+10), TR = 90 mins (75+15)
@@ -140,6 +177,10 @@ class Slot:
             self.atomic_slots.add((d, self.start_min, self.end_min))
 
     def overlaps(self, other_slot):
+        # Fast path: two slots overlap iff they share a time atom
+        if self.time_mask is not None and other_slot.time_mask is not None:
+            return (self.time_mask & other_slot.time_mask) != 0
+
         # Check intersection of atomic slots
         # Two slots overlap if they share a Day AND their time ranges overlap
         for d1, s1, e1 in self.atomic_slots:
@@ -152,12 +193,6 @@ class Slot:
 
     def __repr__(self):
         return self.id
-    
-    def __hash__(self):
-        return hash((self.id, self.slot_type))
-    
-    def __eq__(self, other):
-        return self.id == other.id and self.slot_type == other.slot_type
 
 class ProblemInstance:
     def __init__(self):
@@ -165,17 +200,235 @@ class ProblemInstance:
         self.tutorials = []
         self.lecture_slots = []
         self.tutorial_slots = []
+        # All courses / slots by dense index (State stores these indices in arrays)
+        self.courses = []
+        self.slots = []
         self.incompatible = set() # Set of frozenset({c1, c2})
         self.incompatible_map = defaultdict(set) # course -> set[course]
+        self.pair_map = defaultdict(list) # course -> list[course] (one entry per pair line)
+        self.sections = defaultdict(list) # (dept, number, type) -> list[course]
         self.unwanted = defaultdict(list) # course -> list[slot_id]
         self.preferences = defaultdict(list) # course -> list[(slot_id, value)]
         self.pairs = [] # list[(c1, c2)]
         self.partial_assignments = {} # course -> slot_id
+        self.valid_slots = {} # course -> list[slot] (precompute_valid_slots)
+        self.pref_bounds = {} # course -> lowest preference penalty over its valid slots (unweighted)
         
         # Lookups
         self.courses_by_id = {}
         self.slots_by_id = {} # (id, type) -> Slot
 
+        # Overlap data (precompute_overlaps)
+        self.n_slots = 0
+        self.overlap_table = bytearray() # overlap_table[i * n_slots + j] == 1 iff slots i and j overlap
+        self.overlap_masks = [] # slot index -> bitmask of slot indices overlapping it (itself included)
+
+        # Time groups: sets of courses whose occupied time is kept as one bitmask in State
+        # (500-level lectures, the tutorials of each lecture)
+        self.time_group_ids = {} # key -> group id
+        self.time_group_members = defaultdict(list) # group id -> courses occupying its time
+
+        # Constraint indexes
+        self.tutorials_by_parent = defaultdict(list) # lecture id -> list[course]
+        self.lectures_500 = [] # 500-level lectures
+        self.courses_by_type = defaultdict(list) # "LEC"/"TUT"/"LAB" -> list[course]
+        self.courses_by_number = defaultdict(list) # (dept, number) -> list[course]
+        self.al_courses = [] # courses requiring AL
+
+        # Constraint graph (build_constraint_graph)
+        self.neighbours = [] # course index -> tuple of course indices sharing a constraint
+        self.degree = [] # course index -> static degree
+        self.special_courses = {} # 851/913 -> special CPSC course
+        self.registered_courses = [] # courses added by the solver (special tutorials), not in the input
+
+        # Symmetry breaking (precompute_symmetries)
+        self.symmetry_breaking = False
+        self.slot_canonical = [] # slot index -> index of the first slot identical to it
+        self.slot_twins = [] # slot index -> indices of the identical slots before it
+
+    def add_course(self, course, as_lecture):
+        course.index = len(self.courses)
+        self.courses.append(course)
+        if as_lecture:
+            self.lectures.append(course)
+        else:
+            self.tutorials.append(course)
+        self.courses_by_id[course.id] = course
+        # Sections of the same course (SecDiff)
+        self.sections[course.section_key].append(course)
+
+        if course.type == "TUT" and course.parent_id:
+            self.tutorials_by_parent[course.parent_id].append(course)
+        if course.is_500_level and course.type == "LEC":
+            self.lectures_500.append(course)
+        self.courses_by_type[course.type].append(course)
+        self.courses_by_number[(course.dept, course.number)].append(course)
+        if course.al_required:
+            self.al_courses.append(course)
+        if as_lecture and course.dept == "CPSC" and course.number in (851, 913):
+            self.special_courses.setdefault(course.number, course)
+
+        # 500-level lectures must not overlap each other
+        time_groups = []
+        avoid_groups = []
+        if course.is_500_level and course.type == "LEC":
+            time_groups.append(self.get_time_group("500"))
+            avoid_groups.append(self.get_time_group("500"))
+        # A lecture must not overlap its tutorials
+        if course.type == "TUT" and course.parent_id:
+            time_groups.append(self.get_time_group(course.parent_id))
+        elif course.type == "LEC":
+            avoid_groups.append(self.get_time_group(course.id))
+        course.time_groups = tuple(time_groups)
+        for g in time_groups:
+            self.time_group_members[g].append(course)
+        course.avoid_groups = tuple(avoid_groups)
+
+    def get_time_group(self, key):
+        if key not in self.time_group_ids:
+            self.time_group_ids[key] = len(self.time_group_ids)
+        return self.time_group_ids[key]
+
+    def add_slot(self, slot):
+        slot.index = len(self.slots)
+        self.slots.append(slot)
+        if slot.slot_type == "LEC":
+            self.lecture_slots.append(slot)
+        else:
+            self.tutorial_slots.append(slot)
+        self.slots_by_id[(slot.id, slot.slot_type)] = slot
+
+    def precompute_overlaps(self):
+        # Split every day into elementary intervals between consecutive slot boundaries.
+        # Each slot covers a set of these atoms, so two slots overlap iff their masks intersect.
+        boundaries = defaultdict(set) # day -> set of minutes
+        for slot in self.slots:
+            for d, start, end in slot.atomic_slots:
+                boundaries[d].add(start)
+                boundaries[d].add(end)
+
+        atom_bit = {} # (day, start) -> bit
+        for d in sorted(boundaries):
+            points = sorted(boundaries[d])
+            for start in points[:-1]:
+                atom_bit[(d, start)] = len(atom_bit)
+
+        for slot in self.slots:
+            mask = 0
+            for d, start, end in slot.atomic_slots:
+                points = sorted(boundaries[d])
+                for point in points[:-1]:
+                    if start <= point < end:
+                        mask |= 1 << atom_bit[(d, point)]
+            slot.time_mask = mask
+
+        n = len(self.slots)
+        self.n_slots = n
+        self.overlap_table = bytearray(n * n)
+        self.overlap_masks = [0] * n
+        for i, s1 in enumerate(self.slots):
+            for j, s2 in enumerate(self.slots):
+                if s1.time_mask & s2.time_mask:
+                    self.overlap_table[i * n + j] = 1
+                    self.overlap_masks[i] |= 1 << j
+
+    def precompute_constraint_indexes(self):
+        # Resolve per-course lookups that is_valid would otherwise search for
+        slots_by_name = defaultdict(list) # slot id -> slot indices (LEC and TUT)
+        for slot in self.slots:
+            slots_by_name[slot.id].append(slot.index)
+        for course in self.courses:
+            if course.type == "TUT" and course.parent_id:
+                course.parent = self.get_course(course.parent_id)
+            unwanted = set()
+            for slot_id in self.unwanted.get(course, ()):
+                unwanted.update(slots_by_name[slot_id])
+            course.unwanted_slots = frozenset(unwanted)
+
+    def build_constraint_graph(self):
+        # Courses are adjacent if they share a Not Compatible, Pair, lecture/tutorial,
+        # 500-level or same-course (SecDiff) constraint
+        adjacent = [set() for _ in self.courses]
+
+        def link(group):
+            for c1 in group:
+                for c2 in group:
+                    if c1 is not c2:
+                        adjacent[c1.index].add(c2.index)
+
+        for c1, others in self.incompatible_map.items():
+            for c2 in others:
+                link((c1, c2))
+        for c1, c2 in self.pairs:
+            link((c1, c2))
+        for course in self.courses:
+            if course.parent is not None:
+                link((course, course.parent))
+        link(self.lectures_500)
+        for group in self.sections.values():
+            link(group)
+        for number, special_number in SPECIAL_PARTNERS.items():
+            special = self.special_courses.get(special_number)
+            if special is not None:
+                for course in self.courses_by_number.get(("CPSC", number), ()):
+                    link((course, special))
+
+        self.neighbours = [tuple(sorted(a)) for a in adjacent]
+        self.degree = [len(a) for a in adjacent]
+
+    def precompute_symmetries(self):
+        # Find interchangeable courses (swapping their slots changes neither validity nor
+        # cost) and identical slots, so the search can skip mirror-image subtrees.
+        # Needs valid_slots and the special tutorials; returns (course classes, slot classes).
+        slot_groups = defaultdict(list)
+        for slot in self.slots:
+            slot_groups[(slot.slot_type, slot.id, slot.lecture_max, slot.lecture_min, slot.al_max)].append(slot.index)
+        self.slot_canonical = list(range(len(self.slots)))
+        self.slot_twins = [()] * len(self.slots)
+        slot_classes = [group for group in slot_groups.values() if len(group) > 1]
+        for group in slot_classes:
+            for k, i in enumerate(group):
+                self.slot_canonical[i] = group[0]
+                self.slot_twins[i] = tuple(group[:k])
+
+        course_groups = defaultdict(list)
+        for course in self.courses:
+            key = course.section_key
+            # Courses tied to a specific other course by id are never interchangeable
+            if course in self.partial_assignments or course.parent is not None:
+                continue
+            if course.type == "LEC" and self.tutorials_by_parent.get(course.id):
+                continue
+            if course.dept == "CPSC" and (course.number in SPECIAL_PARTNERS or course.number in SPECIAL_PARTNERS.values()):
+                continue
+            incompatible = self.incompatible_map.get(course, ())
+            pairs = self.pair_map.get(course, ())
+            if any(other.section_key == key for other in list(incompatible) + list(pairs)):
+                continue
+            # A lecture's own tutorial group is empty here, so it does not tell courses apart
+            own_group = self.time_group_ids.get(course.id)
+            avoid_groups = tuple(g for g in course.avoid_groups if g != own_group)
+            signature = (key, course.al_required, course.is_evening, course.is_500_level,
+                         course.time_groups, avoid_groups, course.unwanted_slots,
+                         tuple(slot.index for slot in self.valid_slots[course]),
+                         tuple(sorted(self.preferences.get(course, ()))),
+                         frozenset(other.index for other in incompatible),
+                         tuple(sorted(other.index for other in pairs)))
+            course_groups[signature].append(course)
+
+        for course in self.courses:
+            course.twins_before = ()
+            course.twins_after = ()
+        course_classes = [group for group in course_groups.values() if len(group) > 1]
+        for group in course_classes:
+            indices = [course.index for course in group]
+            for k, course in enumerate(group):
+                course.twins_before = tuple(indices[:k])
+                course.twins_after = tuple(indices[k + 1:])
+
+        self.symmetry_breaking = True
+        return course_classes, slot_classes
+
     def get_course(self, course_id):
         return self.courses_by_id.get(course_id)
     
@@ -191,10 +444,10 @@ class ProblemInstance:
             for slot in possible:
                 # Check static constraints
                 # 1. Unwanted
-                if slot.id in self.unwanted[course]:
+                if slot.index in course.unwanted_slots:
                     continue
                 # 2. Evening
-                if course.is_evening and slot.hour < 18:
+                if course.is_evening and not slot.is_evening:
                     continue
                 # 3. Tuesday 11:00 - REMOVED (Input file allows it)
                 # if course.type == "LEC" and slot.day == "TU" and slot.hour == 11 and slot.minute == 0:
@@ -203,3 +456,32 @@ class ProblemInstance:
                 
                 valid.append(slot)
             self.valid_slots[course] = valid
+            self.pref_bounds[course] = self.pref_bound(course)
+
+    def pref_bound(self, course):
+        # Lower bound on this course's preference penalty over its valid slots, used by the heuristic
+        prefs = self.preferences.get(course, [])
+        base_penalty = sum(p[1] for p in prefs)
+        max_reduction = 0
+        for slot in self.valid_slots[course]:
+            reduction = 0
+            for p_slot_id, p_val in prefs:
+                if slot.id == p_slot_id:
+                    reduction += p_val
+            if reduction > max_reduction:
+                max_reduction = reduction
+        return base_penalty - max_reduction
+
+    def restrict_valid_slots(self, domains):
+        # Keep only the valid slots in domains (course index -> bitmask of slot indices),
+        # e.g. after constraint propagation. Returns the number of slots removed.
+        removed = 0
+        for course in self.courses:
+            dom = domains.get(course.index)
+            if dom is None or course not in self.valid_slots:
+                continue
+            valid = [slot for slot in self.valid_slots[course] if dom >> slot.index & 1]
+            removed += len(self.valid_slots[course]) - len(valid)
+            self.valid_slots[course] = valid
+            self.pref_bounds[course] = self.pref_bound(course)
+        return removed
@@ -0,0 +1,69 @@
+from collections import defaultdict
+
+# Largest nogood kept (number of course -> slot assignments in it)
+MAX_NOGOOD_SIZE = 4
+# Most nogoods kept; later ones are dropped
+MAX_NOGOODS = 20000
+
+def luby(i):
+    # i-th term (from 1) of the Luby sequence 1, 1, 2, 1, 1, 2, 4, 1, 1, 2, 1, 1, 2, 4, 8, ...
+    k = 1
+    while (1 << k) - 1 < i:
+        k += 1
+    while (1 << k) - 1 != i:
+        i -= (1 << (k - 1)) - 1
+        k = 1
+        while (1 << k) - 1 < i:
+            k += 1
+    return 1 << (k - 1)
+
+class NogoodStore:
+    # Nogoods learned by the greedy DFS: small sets of course -> slot assignments that
+    # cannot all hold in any schedule (on top of the same root state). Shared by the
+    # restarts of one search so each one skips the dead ends the earlier ones found.
+    def __init__(self):
+        self.by_literal = defaultdict(list) # (course index, slot index) -> nogoods containing it
+        self.nogoods = set() # tuples of (course index, slot index), sorted
+        self.hits = 0
+
+    def add(self, state, courses):
+        # Record that the current slots of courses (course indices) cannot coexist
+        if len(courses) > MAX_NOGOOD_SIZE or len(self.nogoods) >= MAX_NOGOODS:
+            return
+        nogood = tuple(sorted((i, state.slot_of[i]) for i in courses))
+        if nogood in self.nogoods:
+            return
+        self.nogoods.add(nogood)
+        for literal in nogood:
+            self.by_literal[literal].append(nogood)
+
+    def violated(self, state, course, slot):
+        # If course -> slot would complete a nogood, the other courses in it (course
+        # indices, the reason for the conflict); otherwise None
+        ci = course.index
+        slot_of = state.slot_of
+        for nogood in self.by_literal.get((ci, slot.index), ()):
+            if all(slot_of[i] == s for i, s in nogood if i != ci):
+                self.hits += 1
+                return {i for i, s in nogood if i != ci}
+        return None
+
+class ConstraintWeights:
+    # Weighted degrees for dom/wdeg variable ordering. Each binary constraint (a pair of
+    # courses) gets a weight that grows every time it empties a course's domain; like the
+    # nogoods, the weights carry over from one restart to the next.
+    def __init__(self):
+        self.weight = defaultdict(lambda: defaultdict(int)) # course index -> {other index: weight}
+        self.failures = 0
+
+    def bump(self, course_index, culprits):
+        # The assignments of culprits (course indices) left course_index with no slot
+        self.failures += 1
+        for j in culprits:
+            self.weight[course_index][j] += 1
+            self.weight[j][course_index] += 1
+
+    def wdeg(self, state, course):
+        # 1 + weight of the constraints between course and the other unassigned courses
+        slot_of = state.slot_of
+        return 1 + sum(w for j, w in self.weight.get(course.index, {}).items() if slot_of[j] < 0)
@@ -0,0 +1,337 @@
+import heapq
+import multiprocessing as mp
+import queue
+import random
+import time
+from nogoods import ConstraintWeights, NogoodStore
+from solver import (GREEDY_NODE_LIMIT, TIMEOUT_SECONDS, build_initial_state, find_initial_bound, find_initial_solution,
+                    branch_and_bound, expand, final_cost, heuristic, state_from_slots)
+
+# Work is split until there are this many open subproblems per worker
+SUBPROBLEMS_PER_WORKER = 4
+# How often (in expanded nodes) a worker re-reads the shared bound and reports its node count
+SYNC_INTERVAL = 100
+# How often (in expanded nodes) a worker checks for idle peers to hand work to
+DONATE_INTERVAL = 10
+# How long the portfolio may take to produce its first schedule before the search starts without one
+PORTFOLIO_FIRST_TIMEOUT = 60
+
+def get_context():
+    # Fork keeps the parsed problem in the workers without pickling it
+    if "fork" in mp.get_all_start_methods():
+        return mp.get_context("fork")
+    return mp.get_context()
+
+def split_frontier(initial_state, weights, best_cost, target, deadline=None):
+    # Expand the top levels of the tree best-first until there are at least target
+    # open nodes (or the tree is exhausted, or deadline, a time.time(), has passed).
+    # Returns [(f, state)], plus any complete schedules met on the way.
+    frontier = [(initial_state.cost + heuristic(initial_state, weights), initial_state)]
+    complete = []
+    while frontier and len(frontier) < target:
+        if deadline is not None and time.time() >= deadline:
+            break
+        f, state = heapq.heappop(frontier)
+        if f >= best_cost:
+            continue
+        if state.is_complete():
+            complete.append(state)
+            continue
+        for f_new, next_state in expand(state, weights, best_cost):
+            heapq.heappush(frontier, (f_new, next_state))
+    return frontier, complete
+
+def worker(worker_id, initial_state, weights, tasks, results, best, best_lock, pending, idle, deadline,
+           expanded, node_limit):
+    # Best-first B&B over subproblems taken from the shared task queue.
+    # best: shared incumbent cost; pending: tasks queued or in progress;
+    # idle: workers currently waiting for a task, checked every DONATE_INTERVAL nodes;
+    # expanded: nodes expanded by all workers, reported every SYNC_INTERVAL nodes;
+    # node_limit: optional cap on expanded.
+    stats = {'worker': worker_id, 'nodes_expanded': 0, 'subproblems': 0, 'donated': 0, 'improvements': 0}
+    is_idle = False
+    unreported = 0 # nodes expanded since the last update of expanded
+
+    def report(n):
+        # Add n nodes to expanded; True once node_limit is reached
+        with expanded.get_lock():
+            expanded.value += n
+            return node_limit is not None and expanded.value >= node_limit
+
+    while time.time() < deadline:
+        if node_limit is not None and report(0):
+            break
+        try:
+            f, slot_of = tasks.get(timeout=0.05)
+        except queue.Empty:
+            with pending.get_lock():
+                exhausted = pending.value == 0
+            if exhausted:
+                break # Nothing queued and nobody working: the tree is exhausted
+            if not is_idle:
+                is_idle = True
+                with idle.get_lock():
+                    idle.value += 1
+            continue
+        if is_idle:
+            is_idle = False
+            with idle.get_lock():
+                idle.value -= 1
+
+        stats['subproblems'] += 1
+        pq = [(f, state_from_slots(initial_state, slot_of))]
+        best_cost = best.value
+
+        while pq:
+            f, state = heapq.heappop(pq)
+
+            # Pruning against the global incumbent
+            if f >= best_cost:
+                continue
+
+            if state.is_complete():
+                cost = final_cost(state, weights)
+                with best_lock:
+                    if cost < best.value:
+                        best.value = cost
+                        results.put((cost, list(state.slot_of)))
+                        stats['improvements'] += 1
+                best_cost = best.value
+                continue
+
+            stats['nodes_expanded'] += 1
+            unreported += 1
+            if stats['nodes_expanded'] % SYNC_INTERVAL == 0:
+                best_cost = best.value
+                out_of_nodes = report(unreported)
+                unreported = 0
+                if out_of_nodes or time.time() >= deadline:
+                    break
+            if stats['nodes_expanded'] % DONATE_INTERVAL == 0 and len(pq) > 1:
+                # Work stealing: hand the best open nodes to idle workers
+                with idle.get_lock():
+                    waiting = idle.value
+                if waiting > 0:
+                    for _ in range(min(waiting, len(pq) - 1)):
+                        f_give, give = heapq.heappop(pq)
+                        with pending.get_lock():
+                            pending.value += 1
+                        tasks.put((f_give, list(give.slot_of)))
+                        stats['donated'] += 1
+
+            for f_new, next_state in expand(state, weights, best_cost):
+                heapq.heappush(pq, (f_new, next_state))
+
+        report(unreported)
+        unreported = 0
+        with pending.get_lock():
+            pending.value -= 1
+
+    if is_idle:
+        with idle.get_lock():
+            idle.value -= 1
+    results.put(('stats', stats))
+
+def parallel_solve(problem, weights, workers, forward_check=False, symmetry=False, timeout_seconds=TIMEOUT_SECONDS,
+                   node_limit=None, greedy_node_limit=GREEDY_NODE_LIMIT, on_solution=None):
+    # Same search as solver.solve, but the tree is split at the top levels and the
+    # subproblems are solved by a pool of worker processes that share the incumbent cost.
+    # timeout_seconds, node_limit (over all workers), greedy_node_limit and on_solution are as in solver.solve.
+    # Returns (best_solution, best_cost, per-worker stats).
+    start_time = time.time()
+    deadline = start_time + timeout_seconds
+    initial_state, failure = build_initial_state(problem, weights, forward_check, symmetry)
+    if initial_state is None:
+        if failure is None:
+            return None
+        return failure[0], failure[1], []
+
+    best_solution, best_cost = find_initial_bound(initial_state, weights, greedy_node_limit, deadline)
+    if best_solution and on_solution is not None and on_solution(best_cost, best_solution):
+        print("Search stopped by the solution callback.")
+        return best_solution, best_cost, []
+
+    print(f"Splitting search tree for {workers} workers...")
+    frontier, complete = split_frontier(initial_state, weights, best_cost, workers * SUBPROBLEMS_PER_WORKER, deadline)
+    for state in complete:
+        cost = final_cost(state, weights)
+        if cost < best_cost:
+            best_solution, best_cost = state, cost
+            if on_solution is not None and on_solution(best_cost, best_solution):
+                print("Search stopped by the solution callback.")
+                return best_solution, best_cost, []
+    print(f"Starting parallel Branch-and-Bound on {len(frontier)} subproblems...")
+
+    ctx = get_context()
+    tasks = ctx.Queue()
+    results = ctx.Queue()
+    best = ctx.Value('d', best_cost, lock=False)
+    best_lock = ctx.Lock()
+    pending = ctx.Value('i', len(frontier))
+    idle = ctx.Value('i', 0)
+    expanded = ctx.Value('q', 0)
+
+    for f, state in frontier:
+        tasks.put((f, list(state.slot_of)))
+
+    processes = []
+    for worker_id in range(workers):
+        p = ctx.Process(target=worker, args=(worker_id, initial_state, weights, tasks, results,
+                                             best, best_lock, pending, idle, deadline, expanded, node_limit))
+        p.start()
+        processes.append(p)
+
+    # Collect improved schedules until every worker has reported its stats
+    worker_stats = []
+    cancelled = False
+    while len(worker_stats) < workers:
+        try:
+            item = results.get(timeout=0.5)
+        except queue.Empty:
+            if not any(p.is_alive() for p in processes) and results.empty():
+                break
+            continue
+        if item[0] == 'stats':
+            worker_stats.append(item[1])
+            continue
+        cost, slot_of = item
+        if cost < best_cost:
+            best_cost = cost
+            best_solution = state_from_slots(initial_state, slot_of)
+            print(f"Improved solution found with cost: {best_cost}")
+            if not cancelled and on_solution is not None and on_solution(best_cost, best_solution):
+                print("Search stopped by the solution callback.")
+                cancelled = True
+                # Workers prune every node against this bound and finish their queues
+                with best_lock:
+                    best.value = float('-inf')
+
+    for p in processes:
+        p.join()
+
+    if time.time() >= deadline:
+        print(f"Timeout reached ({timeout_seconds}s). Returning best solution found so far.")
+    elif node_limit is not None and expanded.value >= node_limit:
+        print(f"Node limit reached ({node_limit} nodes). Returning best solution found so far.")
+    worker_stats.sort(key=lambda s: s['worker'])
+    for s in worker_stats:
+        print(f"Worker {s['worker']}: {s['nodes_expanded']} nodes expanded, {s['subproblems']} subproblems, "
+              f"{s['donated']} donated, {s['improvements']} improvements")
+    return best_solution, best_cost, worker_stats
+
+def portfolio_worker(worker_id, initial_state, weights, seed, results, best, best_lock, stop, deadline, node_limit):
+    # Greedy DFS restarts with this worker's own seed, each under node_limit nodes.
+    # Worker 0 starts with the plain (deterministic) greedy order, the others with
+    # randomized ones. After the first schedule, restarts only look for schedules
+    # cheaper than the shared best.
+    random.seed(seed)
+    randomize = worker_id > 0
+    nogoods = NogoodStore()
+    conflict_weights = ConstraintWeights()
+    while not stop.is_set() and time.time() < deadline:
+        nodes_visited = [0]
+        sol, cost = find_initial_solution(initial_state, weights, nodes_visited=nodes_visited,
+                                          randomize=randomize, bound=best.value, nogoods=nogoods,
+                                          conflict_weights=conflict_weights, node_limit=node_limit, deadline=deadline)
+        randomize = True
+        if sol:
+            with best_lock:
+                if cost < best.value:
+                    best.value = cost
+                    results.put((cost, list(sol.slot_of)))
+        elif nodes_visited[0] <= node_limit:
+            # The DFS finished under its node cap: nothing cheaper than the bound exists
+            results.put(('exhausted', worker_id))
+            stop.set()
+            return
+
+class Portfolio:
+    # Differently seeded initial-solution searches running in parallel processes.
+    # wait_first() returns the first feasible schedule; the workers then keep
+    # restarting to improve the bound, and poll() hands over anything better.
+    def __init__(self, initial_state, weights, workers, seed=0, timeout_seconds=TIMEOUT_SECONDS,
+                 greedy_node_limit=GREEDY_NODE_LIMIT):
+        self.initial_state = initial_state
+        self.weights = weights
+        self.workers = workers
+        self.seed = seed
+        self.timeout_seconds = timeout_seconds
+        self.greedy_node_limit = greedy_node_limit
+        self.processes = []
+
+    def start(self):
+        ctx = get_context()
+        self.results = ctx.Queue()
+        self.best = ctx.Value('d', float('inf'), lock=False)
+        self.best_lock = ctx.Lock()
+        self.stop_event = ctx.Event()
+        deadline = time.time() + self.timeout_seconds
+        for worker_id in range(self.workers):
+            p = ctx.Process(target=portfolio_worker,
+                            args=(worker_id, self.initial_state, self.weights, self.seed + worker_id,
+                                  self.results, self.best, self.best_lock, self.stop_event, deadline,
+                                  self.greedy_node_limit))
+            p.daemon = True
+            p.start()
+            self.processes.append(p)
+
+    def wait_first(self, timeout):
+        # First schedule found by any worker as (cost, state), or None after timeout
+        try:
+            cost, slot_of = self.results.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if cost == 'exhausted':
+            return None # Proven: no feasible schedule
+        return cost, state_from_slots(self.initial_state, slot_of)
+
+    def poll(self):
+        # Schedules found since the last call, as [(cost, state)]
+        found = []
+        while True:
+            try:
+                cost, slot_of = self.results.get_nowait()
+            except queue.Empty:
+                return found
+            if cost == 'exhausted':
+                continue
+            found.append((cost, state_from_slots(self.initial_state, slot_of)))
+
+    def stop(self):
+        self.stop_event.set()
+        for p in self.processes:
+            p.join(timeout=1)
+            if p.is_alive():
+                p.terminate()
+        self.processes = []
+
+def portfolio_solve(problem, weights, workers, forward_check=False, symmetry=False, seed=0, timeout_seconds=TIMEOUT_SECONDS,
+                    node_limit=None, greedy_node_limit=GREEDY_NODE_LIMIT, on_solution=None):
+    # solver.solve with the initial bound coming from a portfolio of parallel restarts.
+    # The portfolio keeps running during Branch-and-Bound and feeds it better bounds.
+    # timeout_seconds, node_limit, greedy_node_limit (per restart) and on_solution are as in solver.solve.
+    start_time = time.time()
+    initial_state, failure = build_initial_state(problem, weights, forward_check, symmetry)
+    if initial_state is None:
+        return failure
+
+    print(f"Starting initial-solution portfolio with {workers} processes...")
+    remaining = max(0, timeout_seconds - (time.time() - start_time))
+    portfolio = Portfolio(initial_state, weights, workers, seed, remaining, greedy_node_limit)
+    portfolio.start()
+    try:
+        best_solution, best_cost = None, float('inf')
+        first = portfolio.wait_first(min(PORTFOLIO_FIRST_TIMEOUT, remaining))
+        if first:
+            best_cost, best_solution = first
+            print(f"Initial solution found by portfolio in {time.time() - start_time:.2f}s with cost: {best_cost}")
+            if on_solution is not None and on_solution(best_cost, best_solution):
+                print("Search stopped by the solution callback.")
+                return best_solution, best_cost
+        else:
+            print("No initial solution found by the portfolio. Starting exhaustive search (this may be slow).")
+        remaining = max(0, timeout_seconds - (time.time() - start_time))
+        return branch_and_bound(initial_state, weights, best_solution, best_cost, remaining, incumbents=portfolio,
+                                node_limit=node_limit, on_solution=on_solution)
+    finally:
+        portfolio.stop()
@@ -1,110 +1,128 @@
+import hashlib
+import os
+import pickle
+import re
+import disk_cache
 from models import Course, Slot, ProblemInstance
 
-def parse_file(filename):
-    with open(filename, 'r') as f:
-        lines = [line.strip() for line in f if line.strip()]
+# Parsed problems are cached here (load_problem with use_cache=True), one pickle per input file content
+CACHE_DIR = os.path.join(disk_cache.CACHE_ROOT, "problems")
+# Least recently used pickles are deleted once the cache is larger than this (bytes)
+MAX_CACHE_BYTES = 200 * 1024 * 1024
+# Modules that define what a pickled ProblemInstance holds. Their source hash is part of
+# the cache key and is stored in every pickle, so any change to them ignores old files.
+PARSER_MODULES = ("models.py", "parser.py")
+PARSER_VERSION = disk_cache.source_version(PARSER_MODULES)
+# Bytes read at a time when hashing an input file
+READ_CHUNK = 1 << 16
+
+# Section headers: "Lecture slots:" etc. at the start of a line
+HEADER = re.compile(r"(Name|Lecture slots|Tutorial slots|Lectures|Tutorials|Not compatible|Unwanted|Preferences|Pair|Partial assignments):")
+# Comma with the whitespace around it
+COMMA = re.compile(r"\s*,\s*")
+
+def slot_id_of(day, time):
+    return f"{day}, {time.rstrip('.')}"
+
+def add_not_compatible(problem, line):
+    parts = COMMA.split(line)
+    c1 = problem.get_course(parts[0])
+    c2 = problem.get_course(parts[1])
+    if c1 and c2:
+        problem.incompatible.add(frozenset({c1, c2}))
+        problem.incompatible_map[c1].add(c2)
+        problem.incompatible_map[c2].add(c1)
+
+def add_unwanted(problem, line):
+    parts = COMMA.split(line)
+    c = problem.get_course(parts[0])
+    if c:
+        problem.unwanted[c].append(slot_id_of(parts[1], parts[2]))
+
+def add_preference(problem, line):
+    parts = COMMA.split(line)
+    c = problem.get_course(parts[2])
+    if c:
+        problem.preferences[c].append((slot_id_of(parts[0], parts[1]), int(parts[3])))
 
+def add_pair(problem, line):
+    parts = COMMA.split(line)
+    c1 = problem.get_course(parts[0])
+    c2 = problem.get_course(parts[1])
+    if c1 and c2:
+        problem.pairs.append((c1, c2))
+        problem.pair_map[c1].append(c2)
+        problem.pair_map[c2].append(c1)
+
+def add_partial_assignment(problem, line):
+    parts = COMMA.split(line)
+    c = problem.get_course(parts[0])
+    if c:
+        problem.partial_assignments[c] = slot_id_of(parts[1], parts[2])
+
+# Section header -> handler of its data lines
+HANDLERS = {
+    "Name": lambda problem, line: None, # Ignore name
+    "Lecture slots": lambda problem, line: problem.add_slot(Slot(line, "LEC")),
+    "Tutorial slots": lambda problem, line: problem.add_slot(Slot(line, "TUT")),
+    "Lectures": lambda problem, line: problem.add_course(Course(line), True),
+    "Tutorials": lambda problem, line: problem.add_course(Course(line), False),
+    "Not compatible": add_not_compatible,
+    "Unwanted": add_unwanted,
+    "Preferences": add_preference,
+    "Pair": add_pair,
+    "Partial assignments": add_partial_assignment,
+}
+
+def parse_lines(lines):
+    # Build a ProblemInstance from an iterable of input lines, one line at a time
     problem = ProblemInstance()
-    
-    mode = None
+    handler = None
     for line in lines:
-        if line.startswith("Name:"):
-            mode = "Name"
-            continue
-        elif line.startswith("Lecture slots:"):
-            mode = "Lecture slots"
-            continue
-        elif line.startswith("Tutorial slots:"):
-            mode = "Tutorial slots"
-            continue
-        elif line.startswith("Lectures:"):
-            mode = "Lectures"
-            continue
-        elif line.startswith("Tutorials:"):
-            mode = "Tutorials"
+        line = line.strip()
+        if not line:
             continue
-        elif line.startswith("Not compatible:"):
-            mode = "Not compatible"
-            continue
-        elif line.startswith("Unwanted:"):
-            mode = "Unwanted"
-            continue
-        elif line.startswith("Preferences:"):
-            mode = "Preferences"
-            continue
-        elif line.startswith("Pair:"):
-            mode = "Pair"
-            continue
-        elif line.startswith("Partial assignments:"):
-            mode = "Partial assignments"
-            continue
-            
-        # Process data based on mode
-        if mode == "Name":
-            pass # Ignore name
-        elif mode == "Lecture slots":
-            problem.lecture_slots.append(Slot(line, "LEC"))
-        elif mode == "Tutorial slots":
-            problem.tutorial_slots.append(Slot(line, "TUT"))
-        elif mode == "Lectures":
-            c = Course(line)
-            problem.lectures.append(c)
-            problem.courses_by_id[c.id] = c
-        elif mode == "Tutorials":
-            c = Course(line)
-            problem.tutorials.append(c)
-            problem.courses_by_id[c.id] = c
-        elif mode == "Not compatible":
-            parts = line.split(',')
-            id1 = parts[0].strip()
-            id2 = parts[1].strip()
-            c1 = problem.get_course(id1)
-            c2 = problem.get_course(id2)
-            if c1 and c2:
-                problem.incompatible.add(frozenset({c1, c2}))
-                problem.incompatible_map[c1].add(c2)
-                problem.incompatible_map[c2].add(c1)
-        elif mode == "Unwanted":
-            parts = line.split(',')
-            c_id = parts[0].strip()
-            day = parts[1].strip()
-            time = parts[2].strip().rstrip('.')
-            slot_id = f"{day}, {time}"
-            c = problem.get_course(c_id)
-            if c:
-                problem.unwanted[c].append(slot_id)
-        elif mode == "Preferences":
-            parts = line.split(',')
-            day = parts[0].strip()
-            time = parts[1].strip().rstrip('.')
-            c_id = parts[2].strip()
-            val = int(parts[3].strip())
-            slot_id = f"{day}, {time}"
-            c = problem.get_course(c_id)
-            if c:
-                problem.preferences[c].append((slot_id, val))
-        elif mode == "Pair":
-            parts = line.split(',')
-            id1 = parts[0].strip()
-            id2 = parts[1].strip()
-            c1 = problem.get_course(id1)
-            c2 = problem.get_course(id2)
-            if c1 and c2:
-                problem.pairs.append((c1, c2))
-        elif mode == "Partial assignments":
-            parts = line.split(',')
-            c_id = parts[0].strip()
-            day = parts[1].strip()
-            time = parts[2].strip().rstrip('.')
-            slot_id = f"{day}, {time}"
-            c = problem.get_course(c_id)
-            if c:
-                problem.partial_assignments[c] = slot_id
-
-    # Populate slot lookups
-    for s in problem.lecture_slots:
-        problem.slots_by_id[(s.id, "LEC")] = s
-    for s in problem.tutorial_slots:
-        problem.slots_by_id[(s.id, "TUT")] = s
-        
+        header = HEADER.match(line)
+        if header:
+            handler = HANDLERS[header.group(1)]
+        elif handler is not None:
+            handler(problem, line)
+
+    problem.precompute_overlaps()
+    problem.precompute_constraint_indexes()
+    problem.build_constraint_graph()
+    return problem
+
+def parse_file(filename):
+    # Parse filename one line at a time
+    with open(filename, 'r') as f:
+        return parse_lines(f)
+
+def file_key(filename):
+    # Cache key of filename: hash of the parser version and the file content, read in chunks
+    digest = hashlib.sha256(PARSER_VERSION.encode())
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_problem(filename, use_cache=False):
+    # parse_file, optionally through a cache of parsed problems keyed by file_key. Each
+    # pickle holds (PARSER_VERSION, problem); one from other code is parsed again.
+    if not use_cache:
+        return parse_file(filename)
+
+    path = os.path.join(CACHE_DIR, f"{file_key(filename)}.pickle")
+    try:
+        with open(path, 'rb') as f:
+            version, problem = pickle.load(f)
+        if version == PARSER_VERSION and isinstance(problem, ProblemInstance):
+            disk_cache.touch(path)
+            return problem
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError, TypeError, ValueError):
+        pass # Not cached yet (or unreadable): parse it
+
+    problem = parse_file(filename)
+    if disk_cache.write_atomic(path, lambda f: pickle.dump((PARSER_VERSION, problem), f, protocol=pickle.HIGHEST_PROTOCOL)):
+        disk_cache.evict(CACHE_DIR, MAX_CACHE_BYTES)
     return problem
@@ -0,0 +1,188 @@
+from collections import deque
+from models import USAGE_OFFSET
+
+# Constraint propagation before search: arc consistency (AC-3) over the no-overlap
+# constraints, then Hall's condition for every capacity constraint. Either shrinks the
+# domains of the unassigned courses or proves that no schedule exists.
+
+def slot_indices(mask):
+    # Slot indices in a bitmask, in increasing order
+    result = []
+    while mask:
+        low = mask & -mask
+        result.append(low.bit_length() - 1)
+        mask ^= low
+    return result
+
+def invalid_constraint(state, course, slot):
+    # (constraint, other course or None) for the first hard constraint that rules out
+    # course -> slot (follows State.is_valid)
+    problem = state.problem
+    if state.usage[3 * slot.index + course.usage_offset] >= slot.lecture_max:
+        return "capacity", None
+    if course.al_required and (slot.al_max == 0 or 0 < slot.al_max <= state.al_usage[slot.index]):
+        return "AL capacity", None
+    if course.parent is not None or course.avoid_groups:
+        parent = course.parent
+        if parent is not None and state.slot_of[parent.index] >= 0 and slot.overlaps(problem.slots[state.slot_of[parent.index]]):
+            return "overlaps lecture", parent
+        for g in course.avoid_groups:
+            if slot.time_mask & state.group_time[g]:
+                return "overlaps a tutorial or 500-level lecture", None
+    for other in problem.incompatible_map.get(course, ()):
+        s = state.slot_of[other.index]
+        if s >= 0 and slot.overlaps(problem.slots[s]):
+            return "not compatible with", other
+    if slot.index in course.unwanted_slots:
+        return "unwanted", None
+    if course in problem.partial_assignments and slot.id != problem.partial_assignments[course]:
+        return "partial assignment", None
+    if course.is_evening and not slot.is_evening:
+        return "evening", None
+    if course.type == "LEC" and slot.no_lectures:
+        return "no lectures Tuesday 11:00", None
+    return "special tutorial", None
+
+def invalid_reason(state, course, slot):
+    # Description of the first hard constraint that rules out course -> slot
+    constraint, other = invalid_constraint(state, course, slot)
+    if other is not None:
+        return f"{constraint} {other.id}"
+    return constraint
+
+def no_overlap_arcs(problem, unassigned):
+    # course index -> [(other index, constraint label)] for the binary no-overlap
+    # constraints between unassigned courses
+    arcs = {i: [] for i in unassigned}
+
+    def add(c1, c2, label):
+        if c1.index in arcs and c2.index in arcs and c1 is not c2:
+            arcs[c1.index].append((c2.index, label))
+            arcs[c2.index].append((c1.index, label))
+
+    for c1, others in problem.incompatible_map.items():
+        for c2 in others:
+            if c1.index < c2.index:
+                add(c1, c2, f"Not compatible: {c1.id}, {c2.id}")
+    for course in problem.courses:
+        if course.parent is not None:
+            add(course, course.parent, f"Lecture/tutorial overlap: {course.parent.id}, {course.id}")
+    lectures_500 = problem.lectures_500
+    for k, c1 in enumerate(lectures_500):
+        for c2 in lectures_500[k + 1:]:
+            add(c1, c2, f"500-level lectures: {c1.id}, {c2.id}")
+    return arcs
+
+def arc_consistency(problem, domains, arcs):
+    # AC-3: drop slot s from a course's domain if some neighbour has no slot left that
+    # does not overlap s. Returns None, or the index of the course whose domain emptied
+    # together with the constraints that emptied it.
+    overlap_masks = problem.overlap_masks
+    reasons = {i: set() for i in domains}
+    queue = deque((i, j, label) for i in arcs for j, label in arcs[i])
+    while queue:
+        i, j, label = queue.popleft()
+        dom_j = domains[j]
+        kept = 0
+        for s in slot_indices(domains[i]):
+            if dom_j & ~overlap_masks[s]:
+                kept |= 1 << s
+        if kept == domains[i]:
+            continue
+        domains[i] = kept
+        reasons[i].add(label)
+        reasons[i] |= reasons[j]
+        if not kept:
+            return i, reasons[i]
+        for k, label_k in arcs[i]:
+            if k != j:
+                queue.append((k, i, label_k))
+    return None
+
+def hall_violation(courses, domains, capacity):
+    # Match courses to slots, slot s taking at most capacity[s] courses. Returns None if
+    # every course fits, else (courses, slots): a set of courses that can only use slots
+    # with less total room than there are courses (Hall's condition fails).
+    holders = {s: [] for s in capacity}
+
+    def augment(course, seen):
+        for s in slot_indices(domains[course.index]):
+            if s in seen or s not in capacity:
+                continue
+            seen.add(s)
+            if len(holders[s]) < capacity[s]:
+                holders[s].append(course)
+                return True
+            for other in holders[s]:
+                if augment(other, seen):
+                    holders[s].remove(other)
+                    holders[s].append(course)
+                    return True
+        return False
+
+    for course in courses:
+        seen = set()
+        if not augment(course, seen):
+            # Every slot reached from course is full, and so are the slots reachable
+            # from the courses holding them
+            stuck = [course] + [c for s in sorted(seen) for c in holders[s]]
+            return stuck, sorted(seen)
+    return None
+
+def capacity_groups(state, unassigned):
+    # (label, courses, capacity) for each capacity constraint: courses of one type per
+    # slot, AL courses per slot, and 500-level lectures (pairwise non-overlapping, so at
+    # most one per slot)
+    problem = state.problem
+    groups = []
+    for course_type, offset in USAGE_OFFSET.items():
+        courses = [c for c in unassigned if c.type == course_type]
+        slot_list = problem.lecture_slots if course_type == "LEC" else problem.tutorial_slots
+        capacity = {s.index: max(0, s.lecture_max - state.usage[3 * s.index + offset]) for s in slot_list}
+        groups.append((f"{course_type} capacity", courses, capacity))
+    al_courses = [c for c in unassigned if c.al_required]
+    capacity = {}
+    for s in problem.slots:
+        if s.al_max > 0:
+            capacity[s.index] = max(0, s.al_max - state.al_usage[s.index])
+        elif s.al_max < 0:
+            capacity[s.index] = len(al_courses) # no AL limit
+    groups.append(("AL capacity", al_courses, capacity))
+    lectures_500 = [c for c in unassigned if c.is_500_level and c.type == "LEC"]
+    groups.append(("500-level lectures", lectures_500, {s.index: 1 for s in problem.lecture_slots}))
+    return groups
+
+def propagate(state):
+    # Shrink the domains of the unassigned courses of state (the root of the search).
+    # Returns (domains, conflict): domains maps course index -> bitmask of the slot indices
+    # left; conflict is None, or (verdict, constraints) proving no schedule exists.
+    problem = state.problem
+    unassigned = state.get_unassigned_courses()
+    domains = {}
+    for course in unassigned:
+        dom = 0
+        for slot in problem.valid_slots[course]:
+            if state.is_valid(course, slot):
+                dom |= 1 << slot.index
+        if not dom:
+            constraints = [f"{course.id} -> {slot.id}: {invalid_reason(state, course, slot)}"
+                           for slot in problem.valid_slots[course]]
+            return domains, (f"{course.id} has no valid slot left after the fixed assignments", constraints)
+        domains[course.index] = dom
+
+    wiped = arc_consistency(problem, domains, no_overlap_arcs(problem, domains))
+    if wiped is not None:
+        i, reasons = wiped
+        return domains, (f"Arc consistency leaves no slot for {problem.courses[i].id}", sorted(reasons))
+
+    for label, courses, capacity in capacity_groups(state, unassigned):
+        violation = hall_violation(courses, domains, capacity)
+        if violation is not None:
+            stuck, slot_list = violation
+            room = sum(capacity[s] for s in slot_list)
+            slot_ids = ", ".join(f"{problem.slots[s].id} ({problem.slots[s].slot_type})" for s in slot_list) or "none"
+            constraints = [f"{label}: {len(stuck)} courses but room for {room} in slots {slot_ids}"]
+            constraints += [f"{c.id} can only use those slots" for c in stuck]
+            return domains, (f"Hall's condition fails for {label}", constraints)
+
+    return domains, None
@@ -1,7 +1,28 @@
 import sys
 import argparse
-from parser import parse_file
-from solver import solve
+import json
+import time
+from parser import load_problem
+from solver import GREEDY_NODE_LIMIT, TIMEOUT_SECONDS, solve
+from parallel import parallel_solve, portfolio_solve
+from local_search import LOCAL_SEARCH_SECONDS, improve_solve
+from incremental import INCREMENTAL_RADIUS, INCREMENTAL_SECONDS, incremental_solve, read_schedule
+import state
+import metrics
+
+def solution_stream(out, stop_at):
+    # on_solution callback for the solvers: writes every improved schedule to out (if any)
+    # as a JSON line, and stops the search once its Eval-value is at most stop_at
+    start_time = time.time()
+
+    def on_solution(cost, solution):
+        if out is not None:
+            assignments = {course.id: slot.id for course, slot in sorted(solution.assignments.items(), key=lambda x: x[0].id)}
+            out.write(json.dumps({"seconds": round(time.time() - start_time, 3), "eval_value": int(cost),
+                                  "assignments": assignments}) + "\n")
+            out.flush()
+        return stop_at is not None and cost <= stop_at
+    return on_solution
 
 def main():
     #Define parser for command line arguments
@@ -15,27 +36,102 @@ def main():
     parser.add_argument("pen_tutorialmin", type=float, help="Unused")
     parser.add_argument("pen_notpaired", type=float)
     parser.add_argument("pen_section", type=float)
+    parser.add_argument("--check-cost", action="store_true", help="Debug: verify incremental costs against a full recomputation")
+    parser.add_argument("--forward-check", action="store_true", help="Keep live domains per search node (forward checking)")
+    parser.add_argument("--check-domains", action="store_true", help="Debug: verify forward-checking domains against is_valid")
+    parser.add_argument("--workers", type=int, default=1, help="Run the Branch-and-Bound search in N worker processes")
+    parser.add_argument("--portfolio", type=int, default=0, help="Find the initial bound with N parallel restart processes")
+    parser.add_argument("--strategy", choices=["bestfirst", "dfbnb"], default="bestfirst",
+                        help="Search engine: best-first Branch-and-Bound or depth-first with an undo trail")
+    parser.add_argument("--improve", choices=["local", "lns"],
+                        help="Improve the greedy schedule with local search or large neighbourhood search instead of Branch-and-Bound")
+    parser.add_argument("--improve-seconds", type=float, default=LOCAL_SEARCH_SECONDS, help="Time budget of --improve, greedy DFS included (capped by --time-limit)")
+    parser.add_argument("--warm-start", metavar="PREVIOUS_OUTPUT",
+                        help="Re-solve incrementally from the schedule in an earlier scheduler.py output, keeping its still-valid assignments")
+    parser.add_argument("--previous-input", help="With --warm-start: the input file of the earlier run, to also re-solve the courses whose data changed")
+    parser.add_argument("--warm-radius", type=int, default=INCREMENTAL_RADIUS,
+                        help="With --warm-start: constraint-graph hops freed around each course to repair")
+    parser.add_argument("--warm-seconds", type=float, default=INCREMENTAL_SECONDS, help="Time budget of --warm-start (capped by --time-limit)")
+    parser.add_argument("--flow-bound", action="store_true",
+                        help="Check nodes the cheap bound keeps against a min-cost assignment bound before expanding them")
+    parser.add_argument("--symmetry", action="store_true", help="Skip mirror-image assignments of interchangeable sections and identical slots")
+    parser.add_argument("--time-limit", type=float, default=TIMEOUT_SECONDS, help="Time budget of the search in seconds")
+    parser.add_argument("--node-limit", type=int, help="Stop Branch-and-Bound after expanding this many nodes")
+    parser.add_argument("--greedy-node-limit", type=int, default=GREEDY_NODE_LIMIT, help="Node limit of the first greedy DFS")
+    parser.add_argument("--stream", help="Write every improved schedule as a JSON line to this file ('-' for standard output)")
+    parser.add_argument("--stop-at", type=float, help="Stop as soon as a schedule with at most this Eval-value is found")
+    parser.add_argument("--no-cache", action="store_true", help="Solve the input without the cache of schedules")
+    parser.add_argument("--parse-cache", action="store_true", help="Load the parsed input from (and save it to) the cache of parsed problems")
+    parser.add_argument("--metrics", action="store_true", help="Count validity checks, failures by constraint, prunes and children, and print them")
+    parser.add_argument("--metrics-file", help="Also write the metrics and search events (progress, incumbents) to this JSONL file")
+    parser.add_argument("--profile", nargs="?", const="", help="Run under cProfile and print the top functions (and save the stats to PROFILE)")
+    parser.add_argument("--trace-memory", action="store_true", help="Run under tracemalloc and print the peak and largest allocation sites")
 
     #Read command line
     args = parser.parse_args()
+    if args.node_limit is not None and args.improve:
+        parser.error("--node-limit does not apply to --improve (use --improve-seconds)")
+    state.DEBUG_COST_CHECK = args.check_cost
+    state.DEBUG_DOMAIN_CHECK = args.check_domains
 
     #Parse input file
     print("Parsing input file...")
-    problem = parse_file(args.filename)
+    problem = load_problem(args.filename, use_cache=args.parse_cache)
     print(f"Parsed {len(problem.lectures)} lectures and {len(problem.tutorials)} tutorials.")
 
     #Collect numerical arguments
     weights = (args.w_minfilled, args.w_pref, args.w_pair, args.w_secdiff, args.pen_notpaired, args.pen_section)
 
+    #Streaming of improved schedules
+    on_solution = None
+    stream = None
+    if args.stream:
+        stream = sys.stdout if args.stream == "-" else open(args.stream, "w")
+    if stream is not None or args.stop_at is not None:
+        on_solution = solution_stream(stream, args.stop_at)
+
     #Do the search
     print("Starting solver...")
-    result = solve(problem, weights)
+    if args.metrics or args.metrics_file:
+        metrics.enable()
+    with metrics.profiling(args.profile, args.trace_memory):
+        if args.warm_start:
+            schedule, _ = read_schedule(args.warm_start)
+            old_problem = load_problem(args.previous_input, use_cache=args.parse_cache) if args.previous_input else None
+            result = incremental_solve(problem, weights, schedule, old_problem, forward_check=args.forward_check,
+                                       radius=args.warm_radius, time_budget=min(args.warm_seconds, args.time_limit),
+                                       node_limit=args.node_limit, greedy_node_limit=args.greedy_node_limit, on_solution=on_solution)
+        elif args.improve:
+            result = improve_solve(problem, weights, args.improve, forward_check=args.forward_check, symmetry=args.symmetry,
+                                   time_budget=min(args.improve_seconds, args.time_limit), greedy_node_limit=args.greedy_node_limit,
+                                   on_solution=on_solution)
+        elif args.portfolio > 0:
+            result = portfolio_solve(problem, weights, args.portfolio, forward_check=args.forward_check,
+                                     symmetry=args.symmetry, timeout_seconds=args.time_limit, node_limit=args.node_limit,
+                                     greedy_node_limit=args.greedy_node_limit, on_solution=on_solution)
+        elif args.workers > 1:
+            result = parallel_solve(problem, weights, args.workers, forward_check=args.forward_check,
+                                    symmetry=args.symmetry, timeout_seconds=args.time_limit, node_limit=args.node_limit,
+                                    greedy_node_limit=args.greedy_node_limit, on_solution=on_solution)
+        else:
+            result = solve(problem, weights, forward_check=args.forward_check, strategy=args.strategy,
+                           symmetry=args.symmetry, flow_bound=args.flow_bound, timeout_seconds=args.time_limit,
+                           node_limit=args.node_limit, greedy_node_limit=args.greedy_node_limit,
+                           on_solution=on_solution, use_cache=not args.no_cache)
+    if stream is not None and stream is not sys.stdout:
+        stream.close()
+    recorder = metrics.disable()
+    if recorder is not None:
+        recorder.print_summary()
+        if args.metrics_file:
+            recorder.write_jsonl(args.metrics_file)
+            print(f"Metrics written to {args.metrics_file}")
     
     if result is None:
         print("No solution found (Error or Infeasible).")
         return
 
-    solution, cost = result
+    solution, cost = result[0], result[1]
 
     #Print solution in proper format if a solution exists
     if solution:
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+import time
+import disk_cache
+
+# Schedules found by solve(), one JSON file per (instance, weights, solver code) in
+# CACHE_DIR. Each entry keeps the best schedule found so far, its Eval-value, the seconds
+# searched in total, and whether the last search ran out of nodes ("complete") or was cut
+# short by its time/node limit. Every entry is only the starting bound of the next search,
+# complete ones included: State.heuristic's MinFilled term is not admissible, so a
+# complete search does not prove the schedule optimal.
+
+# Next to the parsed problems of parser.load_problem
+CACHE_DIR = os.path.join(disk_cache.CACHE_ROOT, "solutions")
+# Bump when the key or the entry format changes, to ignore old cache files
+CACHE_VERSION = 2
+# Least recently used entries are deleted once the cache is larger than this (bytes)
+MAX_CACHE_BYTES = 50 * 1024 * 1024
+# Modules whose code decides the schedules found; any change to them starts a new cache
+SOLVER_MODULES = ("models.py", "state.py", "solver.py", "bounds.py", "propagation.py", "nogoods.py")
+SOLVER_VERSION = disk_cache.source_version(SOLVER_MODULES)
+
+def instance_key(problem, weights):
+    # Hash of the parsed input, the weights and the solver code. Everything is sorted, so
+    # the order of the lines in the input file (and of the sections in it) does not matter.
+    # The special tutorials solve() registers on problem are not part of the input, so the
+    # key is the same before and after a solve.
+    lecture_ids = set(c.id for c in problem.lectures)
+    registered = set(problem.registered_courses)
+    data = {
+        "solver": SOLVER_VERSION,
+        "slots": sorted([s.slot_type, s.id, s.lecture_max, s.lecture_min, s.al_max] for s in problem.slots),
+        "courses": sorted([c.id, c.id in lecture_ids, c.al_required] for c in problem.courses if c not in registered),
+        "incompatible": sorted(sorted(c.id for c in pair) for pair in problem.incompatible),
+        "unwanted": sorted([c.id, slot_id] for c, slot_ids in problem.unwanted.items() for slot_id in slot_ids),
+        "preferences": sorted([c.id, slot_id, value] for c, prefs in problem.preferences.items()
+                              for slot_id, value in prefs),
+        "pairs": sorted(sorted([c1.id, c2.id]) for c1, c2 in problem.pairs),
+        "partial": sorted([c.id, slot_id] for c, slot_id in problem.partial_assignments.items()),
+        "weights": [float(w) for w in weights],
+    }
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+def entry_path(key):
+    return os.path.join(CACHE_DIR, f"{key}-v{CACHE_VERSION}.json")
+
+def load(key):
+    # The cached entry for key (a dict, see store), or None
+    path = entry_path(key)
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    disk_cache.touch(path)
+    return entry
+
+def restore(entry, initial_state):
+    # The entry's schedule as a State on top of initial_state, or None if it is not a
+    # complete valid schedule for it (e.g. a hand-edited cache file)
+    problem = initial_state.problem
+    assignments = entry.get("assignments") or {}
+    state = initial_state
+    for course in problem.courses:
+        if state.slot_of[course.index] >= 0:
+            continue
+        slot_id = assignments.get(course.id)
+        slot = None
+        if slot_id is not None:
+            slot = problem.get_slot(slot_id, "LEC" if course.type == "LEC" else "TUT")
+        if slot is None or not state.is_valid(course, slot):
+            return None
+        state = state.assign(course, slot)
+    return state
+
+def store(key, solution, cost, complete, seconds):
+    # Save solution (a complete State) with its cost, unless the cache already has a
+    # cheaper one. complete: the search that found it ran to completion; seconds: its
+    # search time, added to that of the earlier searches of this entry.
+    previous = load(key) or {}
+    if previous.get("eval_value") is not None and previous["eval_value"] < cost:
+        return
+    entry = {
+        "eval_value": cost,
+        "complete": complete,
+        "seconds": round(previous.get("seconds", 0) + seconds, 3),
+        "updated": time.time(),
+        "assignments": {course.id: slot.id for course, slot in sorted(solution.assignments.items(), key=lambda x: x[0].id)},
+    }
+    if disk_cache.write_atomic(entry_path(key), lambda f: f.write(json.dumps(entry).encode())):
+        disk_cache.evict(CACHE_DIR, MAX_CACHE_BYTES)
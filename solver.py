@@ -2,10 +2,23 @@ import heapq
 import random
 from collections import defaultdict
 import time
+import state as state_module
+import metrics
+import solution_cache
 from state import State
+from propagation import propagate
+from bounds import assignment_bound
+from nogoods import ConstraintWeights, NogoodStore, luby
 from models import Course
 
+TIMEOUT_SECONDS = 300 # 5 minutes timeout for the Branch-and-Bound search
+GREEDY_NODE_LIMIT = 5000 # Node limit of the first greedy DFS
+RESTART_NODE_UNIT = 500 # Restart i may visit RESTART_NODE_UNIT * luby(i) nodes
+RESTART_NODE_BUDGET = 50000 # Nodes over all restarts
+
 def calculate_heuristic(state, weights):
+    # Full recomputation of the heuristic. The search uses the incrementally
+    # maintained State.heuristic(); this is the reference it is checked against.
     w_minfilled, w_pref, _, _, _, _ = weights
     h = 0
     
@@ -25,15 +38,15 @@ def calculate_heuristic(state, weights):
     for course in unassigned:
         # Use precomputed valid slots (Static validity)
         # This is a relaxation (ignores dynamic constraints), so it overestimates potential usage,
-        # which underestimates penalty (Admissible).
+        # which underestimates the penalty of slots that end up in use. Slots that end up
+        # empty are not penalized by the final cost, so the term as a whole is not admissible.
         for slot in state.problem.valid_slots[course]:
             potential_additions[slot] += 1
             
     # Check all slots
     all_slots = state.problem.lecture_slots + state.problem.tutorial_slots
     for slot in all_slots:
-        current_usage = state.slot_usage.get(slot, {'LEC': 0, 'TUT': 0, 'LAB': 0})
-        total_current = current_usage['LEC'] + current_usage['TUT'] + current_usage['LAB']
+        total_current = state.slot_total(slot)
         max_possible = total_current + potential_additions[slot]
         
         if max_possible < slot.lecture_min:
@@ -69,17 +82,63 @@ def calculate_heuristic(state, weights):
 
     return h
 
-def find_initial_solution(state, weights, depth=0, nodes_visited=None, randomize=False):
+def heuristic(state, weights):
+    h = state.heuristic()
+    if state_module.DEBUG_COST_CHECK:
+        full_h = calculate_heuristic(state, weights)
+        assert abs(full_h - h) < 1e-6, f"Heuristic mismatch: incremental {h} vs full {full_h}"
+    return h
+
+def find_initial_solution(state, weights, depth=0, nodes_visited=None, randomize=False, bound=float('inf'), nogoods=None,
+                          conflict_weights=None, node_limit=GREEDY_NODE_LIMIT, deadline=None):
+    # bound: only look for schedules cheaper than this (used when improving an incumbent)
+    # nogoods: optional NogoodStore; nogoods learned here are added to it and checked,
+    # so restarts sharing a store skip the dead ends found before
+    # conflict_weights: optional ConstraintWeights; variables are then picked by
+    # dom/wdeg and the weights grow with every domain wipe-out
+    # deadline: optional time.time() after which the search gives up as if out of nodes
     if nodes_visited is None:
         nodes_visited = [0]
-    
+    sol, cost, _ = backjump_search(state, weights, nodes_visited, randomize, bound, nogoods, conflict_weights, node_limit,
+                                   deadline)
+    return sol, cost
+
+def assigned_courses(state):
+    return {i for i, s in enumerate(state.slot_of) if s >= 0}
+
+def wipeout_conflict(state):
+    # Forward checking emptied a domain: (that course, the assignments that ruled out
+    # all its slots)
+    problem = state.problem
+    for course in state.get_unassigned_courses():
+        if not state.domains[course.index]:
+            conflict = set()
+            occupants = state.slot_occupants()
+            for slot in problem.valid_slots[course]:
+                conflict |= state.conflict_set(course, slot, occupants)
+            return course, conflict
+    return None, assigned_courses(state)
+
+def backjump_search(state, weights, nodes_visited, randomize, bound, nogoods, conflict_weights, node_limit, deadline):
+    # Greedy DFS with conflict-directed backjumping. Returns (solution, cost, conflict).
+    # On failure, conflict is a set of assigned course indices whose assignments explain
+    # it: a caller whose own course is not in the set returns at once, since no other
+    # value of that course can help. conflict is None when the node limit was hit.
     nodes_visited[0] += 1
-    if nodes_visited[0] > 5000: # Increased limit to 5000 nodes
-        return None, float('inf')
+    if deadline is not None and nodes_visited[0] % 100 == 0 and time.time() > deadline:
+        nodes_visited[0] = node_limit + 1 # Out of time: stop as if the node limit was hit
+    if nodes_visited[0] > node_limit:
+        return None, float('inf'), None
+
+    if bound < float('inf') and state.cost + state.heuristic() >= bound:
+        return None, float('inf'), assigned_courses(state)
 
     # Greedy DFS to find ONE solution quickly
     if state.is_complete():
-        return state, state.calculate_cost(weights) + state.calculate_minfilled_cost(weights[0])
+        cost = final_cost(state, weights)
+        if cost >= bound:
+            return None, float('inf'), assigned_courses(state)
+        return state, cost, None
     
     # MRV
     unassigned = state.get_unassigned_courses()
@@ -88,36 +147,48 @@ def find_initial_solution(state, weights, depth=0, nodes_visited=None, randomize
     min_valid = float('inf')
     
     # Optimization: Just pick one with the fewest slots to fail fast
+    # dom/wdeg: divide by the weighted degree once some constraints have failed
+    weighted = conflict_weights is not None and conflict_weights.failures > 0
     candidates = []
     for course in unassigned:
-        valid_slots = []
-        for slot in state.problem.valid_slots[course]:
-            if state.is_valid(course, slot):
-                valid_slots.append(slot)
-        if len(valid_slots) < min_valid:
-            min_valid = len(valid_slots)
+        if state.domains is not None:
+            # Forward checking: domain sizes are cached, build the slot list only for the winner
+            valid_slots = None
+            count = state.domains[course.index].bit_count()
+        else:
+            valid_slots = []
+            for slot in state.problem.valid_slots[course]:
+                if state.is_valid(course, slot):
+                    valid_slots.append(slot)
+            count = len(valid_slots)
+        if weighted:
+            count /= conflict_weights.wdeg(state, course)
+        if count < min_valid:
+            min_valid = count
             best_var = course
             candidates = [(course, valid_slots)]
-        elif len(valid_slots) == min_valid:
+        elif count == min_valid:
             candidates.append((course, valid_slots))
             
     # Tie-break with degree?
     # Just pick first for speed
     if not candidates:
-        return None, float('inf')
+        return None, float('inf'), assigned_courses(state)
         
     # Sort candidates by degree?
     if randomize:
         best_var, valid_slots = random.choice(candidates)
     else:
         best_var, valid_slots = candidates[0]
+    if valid_slots is None:
+        valid_slots = state.domain_slots(best_var)
+    valid_slots = symmetry_filter(state, best_var, valid_slots)
     
     # LCV
     # Sort slots by cost
     scored_slots = []
     for slot in valid_slots:
-        next_state = state.assign(best_var, slot)
-        cost = next_state.calculate_cost(weights)
+        cost = state.cost + state.cost_delta(best_var, slot)
         scored_slots.append((cost, slot))
     
     if randomize:
@@ -128,19 +199,66 @@ def find_initial_solution(state, weights, depth=0, nodes_visited=None, randomize
     else:
         scored_slots.sort(key=lambda x: x[0])
     
+    ci = best_var.index
+    conflict = set()
+    explored = False
     for _, slot in scored_slots:
+        if nogoods is not None:
+            culprits = nogoods.violated(state, best_var, slot)
+            if culprits is not None:
+                conflict |= culprits
+                continue
         next_state = state.assign(best_var, slot)
-        sol, cost = find_initial_solution(next_state, weights, depth+1, nodes_visited, randomize)
+        if next_state.dead:
+            wiped, culprits = wipeout_conflict(next_state)
+            if conflict_weights is not None and wiped is not None:
+                conflict_weights.bump(wiped.index, culprits)
+            conflict |= culprits - {ci}
+            continue
+        explored = True
+        sol, cost, child_conflict = backjump_search(next_state, weights, nodes_visited, randomize, bound, nogoods,
+                                                    conflict_weights, node_limit, deadline)
         if sol:
-            return sol, cost
-            
-    return None, float('inf')
+            return sol, cost, None
+        if child_conflict is None:
+            return None, float('inf'), None
+        if ci not in child_conflict:
+            return None, float('inf'), child_conflict # Backjump past this course
+        conflict |= child_conflict - {ci}
 
+    # Every value failed: add what ruled out the slots that were never tried
+    tried = {slot.index for _, slot in scored_slots}
+    occupants = state.slot_occupants()
+    for slot in state.problem.valid_slots[best_var]:
+        if slot.index not in tried:
+            if state.problem.symmetry_breaking and state.is_valid(best_var, slot):
+                conflict |= assigned_courses(state) # Skipped as a mirror image, not a conflict
+            else:
+                conflict |= state.conflict_set(best_var, slot, occupants)
+    if conflict_weights is not None and not explored:
+        conflict_weights.bump(ci, conflict) # No value of best_var got past its own checks
+    # Learn the conflict unless it depends on the bound or on symmetry breaking
+    if nogoods is not None and bound == float('inf') and not state.problem.symmetry_breaking:
+        nogoods.add(state, conflict)
+    return None, float('inf'), conflict
 
 
 
-def solve(problem, weights):
-    # Weights: Wminfilled, Wpref, Wpair, Wsecdiff, pen_notpaired, pen_section
+
+def register_special_course(problem, course_id):
+    # Reuse the course if a previous solve() on this problem already added it
+    course = problem.get_course(course_id)
+    if course is None:
+        course = Course(course_id)
+        # Add the special TUT to the list of lectures to ensure len(assignments) is consistent
+        problem.add_course(course, True)
+        problem.registered_courses.append(course)
+    return course
+
+def build_initial_state(problem, weights, forward_check=False, symmetry=False):
+    # Precompute the static data and build the root State (partial assignments and
+    # special tutorials applied). Returns (initial_state, None), or (None, result)
+    # where result is what solve() should return for this input.
     
     # Precompute valid slots
     print("Precomputing valid slots...")
@@ -152,23 +270,8 @@ def solve(problem, weights):
             print(f"CRITICAL ERROR: Course {course.id} has NO valid slots after precomputation!")
             print(f"  Unwanted: {problem.unwanted[course]}")
             print(f"  Evening: {course.is_evening}")
-            return None, float('inf')
+            return None, (None, float('inf'))
     
-    # Initial State
-    initial_state = State(problem)
-    
-    # Apply Partial Assignments first (Hard Constraint)
-    for course, slot_id in problem.partial_assignments.items():
-        slot_type = "LEC" if course.type == "LEC" else "TUT"
-        slot = problem.get_slot(slot_id, slot_type)
-        if not slot:
-            print(f"Error: Partial assignment slot {slot_id} not found for {course.id}")
-            return None
-        if not initial_state.is_valid(course, slot):
-            print(f"Error: Partial assignment {course.id} to {slot_id} is invalid")
-            return None
-        initial_state = initial_state.assign(course, slot)
-
     # If CPSC 351 and/or CPSC 413 are in the input
     c351 = None
     c413 = None
@@ -186,165 +289,508 @@ def solve(problem, weights):
             special_slot = s
             special_slot_max = special_slot.lecture_max
 
+    # Register the special tutorials before building the initial State so its arrays cover them
+    if c351 and special_slot:
+        c851 = register_special_course(problem, "CPSC 851 TUT 01")
+    if c413 and special_slot:
+        c913 = register_special_course(problem, "CPSC 913 TUT 01")
+
+    # Initial State
+    initial_state = State(problem, weights=weights)
+    
+    # Apply Partial Assignments first (Hard Constraint)
+    for course, slot_id in problem.partial_assignments.items():
+        slot_type = "LEC" if course.type == "LEC" else "TUT"
+        slot = problem.get_slot(slot_id, slot_type)
+        if not slot:
+            print(f"Error: Partial assignment slot {slot_id} not found for {course.id}")
+            return None, None
+        if not initial_state.is_valid(course, slot):
+            print(f"Error: Partial assignment {course.id} to {slot_id} is invalid")
+            return None, None
+        initial_state = initial_state.assign(course, slot)
+
     # If its required tutorial slot is a valid slot, assign the tutorial to that slot
     if c351:
         if special_slot and c413:
             if special_slot_max < 2:
                 print(f"Special tutorial time for CPSC 851 and CPSC 913 can only handle 1 spot")
-                return None, float('inf')
+                return None, (None, float('inf'))
         if special_slot:
-            c851 = Course("CPSC 851 TUT 01")
-            # Add the special TUT to the list of lectures to ensure len(assignments) is consistent
-            problem.lectures.append(c851)
             initial_state = initial_state.assign(c851, special_slot)
         else:
             print(f"CRITICAL ERROR: Special Tutorial for CPSC 851 has NO valid slots after precomputation!")
             print(f"Since CPSC 351 is assigned, CPSC 851 must have its special tutorial assigned")
-            return None, float('inf')
+            return None, (None, float('inf'))
 
     # If its required tutorial slot is a valid slot, assign the tutorial to that slot
     if c413:
         if special_slot and c351:
             if special_slot_max < 2:
                 print(f"Special tutorial time for CPSC 851 and CPSC 913 can only handle 1 spot")
-                return None, float('inf')
+                return None, (None, float('inf'))
         if special_slot:
-            c913 = Course("CPSC 913 TUT 01")
-            # Add the special TUT to the list of lectures to ensure len(assignments) is consistent
-            problem.lectures.append(c913)
             initial_state = initial_state.assign(c913, special_slot)
         else:
             print(f"CRITICAL ERROR: Special Tutorial for CPSC 913 has NO valid slots after precomputation!")
             print(f"Since CPSC 413 is assigned, CPSC 913 must have its special tutorial assigned")
-            return None, float('inf')
+            return None, (None, float('inf'))
+
+    # Constraint propagation: drop slots no schedule can use, or prove there is no schedule
+    domains, conflict = propagate(initial_state)
+    if conflict is not None:
+        verdict, constraints = conflict
+        print(f"INFEASIBLE: {verdict}")
+        print("  Conflicting constraints:")
+        for constraint in constraints:
+            print(f"    {constraint}")
+        return None, (None, float('inf'))
+    removed = problem.restrict_valid_slots(domains)
+    if removed:
+        print(f"Constraint propagation removed {removed} slots from the domains.")
+        # The heuristic terms of the root depend on the valid slots, so rebuild it
+        initial_state = state_from_slots(State(problem, weights=weights), initial_state.slot_of)
 
+    # Symmetry breaking: interchangeable sections and identical slots
+    problem.symmetry_breaking = False
+    if symmetry:
+        course_classes, slot_classes = problem.precompute_symmetries()
+        print(f"Symmetry breaking: {len(course_classes)} classes of interchangeable courses "
+              f"({sum(len(c) for c in course_classes)} courses), {len(slot_classes)} classes of identical slots")
+
+    # Forward checking: every node carries the live domain of each unassigned course
+    if forward_check:
+        initial_state.init_domains()
+        if initial_state.dead:
+            print("No valid slots left for some course after the initial assignments (forward checking).")
+            return None, (None, float('inf'))
+
+    return initial_state, None
+
+def find_initial_bound(initial_state, weights, greedy_node_limit=GREEDY_NODE_LIMIT, deadline=None):
     # 1. Find Initial Solution (Greedy DFS) to set bound
     # This helps prune the search space massively
+    # greedy_node_limit: node limit of the first greedy DFS; deadline: optional time.time()
+    # at which the greedy DFS and the restarts give up
     print("Finding initial solution (Greedy DFS) to set bound...")
-    best_solution, best_cost = find_initial_solution(initial_state, weights)
+    # Nogoods and constraint weights learned by the greedy DFS carry over to the restarts
+    nogoods = NogoodStore()
+    conflict_weights = ConstraintWeights()
+    recorder = metrics.RECORDER
+    nodes_visited = [0]
+    best_solution, best_cost = find_initial_solution(initial_state, weights, nodes_visited=nodes_visited, nogoods=nogoods,
+                                                     conflict_weights=conflict_weights, node_limit=greedy_node_limit,
+                                                     deadline=deadline)
+    if recorder is not None:
+        recorder.count("greedy nodes", min(nodes_visited[0], greedy_node_limit))
     
     if best_solution:
         print(f"Initial solution found with cost: {best_cost}")
+        if recorder is not None:
+            recorder.incumbent(best_cost, "greedy")
     else:
         print("No initial solution found with greedy DFS. Trying randomized restarts...")
-        # Try randomized restarts
-        for i in range(10): # Increased to 10 restarts
-            print(f"Restart {i+1}/10...")
-            sol, cost = find_initial_solution(initial_state, weights, nodes_visited=[0], randomize=True)
+        # Randomized restarts with dom/wdeg ordering, node limits following the Luby sequence
+        i = 0
+        spent = 0
+        while spent < RESTART_NODE_BUDGET:
+            if deadline is not None and time.time() > deadline:
+                print("Out of time for restarts.")
+                break
+            i += 1
+            node_limit = RESTART_NODE_UNIT * luby(i)
+            print(f"Restart {i} ({node_limit} nodes)...")
+            nodes_visited = [0]
+            sol, cost = find_initial_solution(initial_state, weights, nodes_visited=nodes_visited, randomize=True,
+                                              nogoods=nogoods, conflict_weights=conflict_weights, node_limit=node_limit,
+                                              deadline=deadline)
+            spent += min(nodes_visited[0], node_limit)
+            if recorder is not None:
+                recorder.count("restarts")
+                recorder.count("greedy nodes", min(nodes_visited[0], node_limit))
             if sol:
                 best_solution = sol
                 best_cost = cost
-                print(f"Initial solution found in restart {i+1} with cost: {best_cost}")
+                print(f"Initial solution found in restart {i} with cost: {best_cost}")
+                if recorder is not None:
+                    recorder.incumbent(best_cost, f"restart {i}")
+                break
+            if nodes_visited[0] <= node_limit:
+                print(f"Restart {i} searched the whole tree without finding a schedule.")
                 break
         
+        print(f"Restarts used {len(nogoods.nogoods)} learned nogoods ({nogoods.hits} prunings) "
+              f"and {conflict_weights.failures} constraint weight updates.")
         if not best_solution:
             print("No initial solution found after restarts. Starting exhaustive search (this may be slow).")
 
-    # 1. Find Initial Solution (Greedy + Restarts) to set bound
-    # print("Finding initial solution (Greedy + Restarts)...")
-    # best_solution, best_cost = build_initial_solution_greedy(initial_state, problem, weights)
+    return best_solution, best_cost
 
-    # if best_solution is not None:
-    #     print(f"Initial solution found with cost: {best_cost}")
-    # else:
-    #     print("No initial solution found with greedy restarts. Proceeding without initial bound.")
-    #     best_cost = float('inf')
+def select_variable(state):
+    # MRV: Select unassigned variable. Returns (course, valid slots), or (None, []) if
+    # some course has no valid slot left.
+    if state.domains is not None:
+        # Live domains and degrees are kept per node; the heap yields the MRV choice directly
+        best_var = state.select_variable()
+        if best_var is None or not state.domains[best_var.index]:
+            return None, []
+        return best_var, symmetry_filter(state, best_var, state.domain_slots(best_var))
 
-    
+    best_var = None
+    best_valid_slots = []
+    min_valid_count = float('inf')
+    max_degree = -1
+
+    for course in state.get_unassigned_courses():
+        # Find valid slots
+        # Use precomputed static slots to filter first?
+        # Then check dynamic constraints.
+        valid_slots = []
+        possible_slots = state.problem.valid_slots[course] # Optimization
+        
+        for slot in possible_slots:
+            if state.is_valid(course, slot):
+                valid_slots.append(slot)
+        
+        count = len(valid_slots)
+        
+        # Degree Heuristic: unassigned neighbours in the constraint graph
+        degree = state.free_degree[course.index]
+        
+        if count < min_valid_count:
+            min_valid_count = count
+            best_var = course
+            best_valid_slots = valid_slots
+            max_degree = degree
+        elif count == min_valid_count:
+            if degree > max_degree:
+                best_var = course
+                best_valid_slots = valid_slots
+                max_degree = degree
+
+    if min_valid_count == 0:
+        return None, []
+    return best_var, symmetry_filter(state, best_var, best_valid_slots)
+
+def symmetry_filter(state, course, slots):
+    # Drop the values that only mirror other subtrees (see State.symmetric_duplicate)
+    if not state.problem.symmetry_breaking:
+        return slots
+    return [slot for slot in slots if not state.symmetric_duplicate(course, slot)]
+
+def expand(state, weights, best_cost):
+    # Children of state for the MRV variable, as (f, child) in LCV order, keeping
+    # only those that can still beat best_cost
+    best_var, best_valid_slots = select_variable(state)
+    if best_var is None:
+        return []
+        
+    # Value Ordering: LCV
+    scored_slots = []
+    for slot in best_valid_slots:
+        next_state = state.assign(best_var, slot)
+        if next_state.dead:
+            continue # Forward checking emptied some domain
+        g = next_state.cost
+        h = heuristic(next_state, weights)
+        f_new = g + h
+        scored_slots.append((f_new, next_state))
+        
+    scored_slots.sort(key=lambda x: x[0])
+    children = [(f_new, next_state) for f_new, next_state in scored_slots if f_new < best_cost]
+    recorder = metrics.RECORDER
+    if recorder is not None:
+        recorder.count("children generated", len(best_valid_slots))
+        recorder.count("children pruned by forward checking", len(best_valid_slots) - len(scored_slots))
+        recorder.count("children pruned by bound", len(scored_slots) - len(children))
+    return children
+
+def final_cost(state, weights):
+    # Eval-value of a complete schedule (including MinFilled)
+    return state.cost + state.calculate_minfilled_cost(weights[0])
+
+def state_from_slots(initial_state, slot_of):
+    # Rebuild a State from a slot-index array (e.g. sent back by a worker process)
+    # by assigning, on top of initial_state, every course it has that initial_state lacks
+    state = initial_state
+    courses = initial_state.problem.courses
+    slots = initial_state.problem.slots
+    for i, s in enumerate(slot_of):
+        if s >= 0 and state.slot_of[i] < 0:
+            state = state.assign(courses[i], slots[s])
+    return state
+
+def branch_and_bound(initial_state, weights, best_solution, best_cost, timeout_seconds=TIMEOUT_SECONDS, incumbents=None,
+                     quiet=False, flow_bound=False, stats=None, node_limit=None, on_solution=None):
+    # incumbents: optional source of schedules found elsewhere (e.g. parallel.Portfolio);
+    # its poll() returns [(cost, state)] and better ones tighten the bound.
+    # quiet: no progress output (for callers that run many short searches)
+    # flow_bound: nodes the cheap bound keeps are checked against bounds.assignment_bound before expansion
+    # stats: optional dict, gets "nodes_expanded", "complete" (the search ran out of nodes rather
+    # than time, node limit or callback) and (if none is there yet) "first_solution_time"
+    # node_limit: optional cap on the nodes expanded
+    # on_solution: optional on_solution(cost, state), called with every improved schedule;
+    # if it returns True the search stops and returns that schedule
     # 2. Branch-and-Bound Search (A*)
-    print("Starting Branch-and-Bound search...")
+    if not quiet:
+        print("Starting Branch-and-Bound search...")
     pq = []
-    start_g = initial_state.calculate_cost(weights)
-    start_h = calculate_heuristic(initial_state, weights)
+    start_g = initial_state.cost
+    start_h = heuristic(initial_state, weights)
     heapq.heappush(pq, (start_g + start_h, initial_state))
     
     nodes_expanded = 0
+    flow_evaluated = 0
+    flow_pruned = 0
+    recorder = metrics.RECORDER
     
     start_time = time.time()
-    timeout_seconds = 300 # 5 minutes timeout
     
     while pq:
         # Check timeout
         if time.time() - start_time > timeout_seconds:
-            print(f"Timeout reached ({timeout_seconds}s). Returning best solution found so far.")
+            if not quiet:
+                print(f"Timeout reached ({timeout_seconds}s). Returning best solution found so far.")
+            break
+        if node_limit is not None and nodes_expanded >= node_limit:
+            if not quiet:
+                print(f"Node limit reached ({node_limit} nodes). Returning best solution found so far.")
             break
             
         f, state = heapq.heappop(pq)
         
         # Pruning
         if f >= best_cost:
+            if recorder is not None:
+                recorder.count("nodes pruned by bound")
             continue
             
         if state.is_complete():
             # Calculate FINAL cost including MinFilled
-            final_cost = state.calculate_cost(weights) + state.calculate_minfilled_cost(weights[0])
-            if final_cost < best_cost:
-                best_cost = final_cost
+            cost = final_cost(state, weights)
+            if cost < best_cost:
+                best_cost = cost
                 best_solution = state
+                if stats is not None:
+                    stats.setdefault("first_solution_time", time.time())
+                if recorder is not None:
+                    recorder.incumbent(best_cost, "branch and bound")
+                if on_solution is not None and on_solution(best_cost, best_solution):
+                    print("Search stopped by the solution callback.")
+                    break
             continue
+
+        # Stronger bound, only for nodes the cheap one could not prune
+        if flow_bound:
+            flow_evaluated += 1
+            if state.cost + assignment_bound(state) >= best_cost:
+                flow_pruned += 1
+                continue
             
         nodes_expanded += 1
         if nodes_expanded % 1000 == 0:
-            print(f"Nodes expanded: {nodes_expanded}, PQ size: {len(pq)}, Current Best Cost: {best_cost}")
-        
-        # MRV: Select unassigned variable
-        unassigned = state.get_unassigned_courses()
-        
-        best_var = None
-        best_valid_slots = []
-        min_valid_count = float('inf')
-        max_degree = -1
-        
-        for course in unassigned:
-            # Find valid slots
-            # Use precomputed static slots to filter first?
-            # Then check dynamic constraints.
-            valid_slots = []
-            possible_slots = problem.valid_slots[course] # Optimization
-            
-            for slot in possible_slots:
-                if state.is_valid(course, slot):
-                    valid_slots.append(slot)
-            
-            count = len(valid_slots)
-            
-            # Degree Heuristic
-            degree = 0
-            for s in problem.incompatible:
-                if course in s: degree += 1
-            for p in problem.pairs:
-                if course in p: degree += 1
-            
-            if count < min_valid_count:
-                min_valid_count = count
-                best_var = course
-                best_valid_slots = valid_slots
-                max_degree = degree
-            elif count == min_valid_count:
-                if degree > max_degree:
-                    best_var = course
-                    best_valid_slots = valid_slots
-                    max_degree = degree
+            if not quiet:
+                print(f"Nodes expanded: {nodes_expanded}, PQ size: {len(pq)}, Current Best Cost: {best_cost}")
+            if recorder is not None:
+                recorder.event("progress", nodes=nodes_expanded, heap=len(pq), best=best_cost)
+        if incumbents is not None and nodes_expanded % 100 == 0:
+            improved = False
+            for cost, solution in incumbents.poll():
+                if cost < best_cost:
+                    best_cost = cost
+                    best_solution = solution
+                    improved = True
+                    print(f"Improved bound from portfolio: {best_cost}")
+                    if recorder is not None:
+                        recorder.incumbent(best_cost, "portfolio")
+            if improved and on_solution is not None and on_solution(best_cost, best_solution):
+                print("Search stopped by the solution callback.")
+                break
         
-        if best_var is None:
+        for f_new, next_state in expand(state, weights, best_cost):
+            heapq.heappush(pq, (f_new, next_state))
+
+    if flow_bound and not quiet:
+        print(f"Assignment bound pruned {flow_pruned} of {flow_evaluated} nodes it was evaluated on.")
+    if stats is not None:
+        stats["nodes_expanded"] = nodes_expanded
+        stats["complete"] = not pq
+    if recorder is not None:
+        recorder.count("nodes expanded", nodes_expanded)
+        if flow_bound:
+            recorder.count("nodes pruned by assignment bound", flow_pruned)
+        recorder.event("progress", nodes=nodes_expanded, heap=len(pq), best=best_cost)
+    return best_solution, best_cost
+
+def score_in_place(state, weights, best_cost):
+    # expand() for a working state: the MRV variable and its values in LCV order as
+    # [(f, slot)], each scored by applying it in place and undoing it again
+    best_var, best_valid_slots = select_variable(state)
+    if best_var is None:
+        return None, []
+
+    scored_slots = []
+    dead = 0
+    for slot in best_valid_slots:
+        state.apply(best_var, slot)
+        if state.dead:
+            dead += 1
+        else:
+            f_new = state.cost + heuristic(state, weights)
+            if f_new < best_cost:
+                scored_slots.append((f_new, slot))
+        state.undo()
+
+    scored_slots.sort(key=lambda x: x[0])
+    recorder = metrics.RECORDER
+    if recorder is not None:
+        recorder.count("children generated", len(best_valid_slots))
+        recorder.count("children pruned by forward checking", dead)
+        recorder.count("children pruned by bound", len(best_valid_slots) - dead - len(scored_slots))
+    return best_var, scored_slots
+
+def depth_first_branch_and_bound(initial_state, weights, best_solution, best_cost, timeout_seconds=TIMEOUT_SECONDS,
+                                 flow_bound=False, stats=None, node_limit=None, on_solution=None):
+    # Depth-first Branch-and-Bound on a single working State: children are applied in
+    # place and undone on backtrack, so memory grows with the depth, not the frontier.
+    # Same MRV/LCV ordering and f = g + h bound (and optional flow_bound, stats, node_limit,
+    # on_solution) as branch_and_bound.
+    print("Starting depth-first Branch-and-Bound search...")
+    if initial_state.is_complete():
+        cost = final_cost(initial_state, weights)
+        if stats is not None:
+            stats["nodes_expanded"] = 0
+            stats["complete"] = True
+        if cost < best_cost:
+            if stats is not None:
+                stats.setdefault("first_solution_time", time.time())
+            if on_solution is not None:
+                on_solution(cost, initial_state)
+            return initial_state, cost
+        return best_solution, best_cost
+
+    state = initial_state.copy(trail=[])
+    # One entry per depth: the variable and an iterator over its remaining (f, slot)
+    course, choices = score_in_place(state, weights, best_cost)
+    stack = [(course, iter(choices))]
+    nodes_expanded = 0
+    flow_evaluated = 0
+    flow_pruned = 0
+    recorder = metrics.RECORDER
+    start_time = time.time()
+
+    while stack:
+        # Check timeout
+        if time.time() - start_time > timeout_seconds:
+            print(f"Timeout reached ({timeout_seconds}s). Returning best solution found so far.")
+            break
+        if node_limit is not None and nodes_expanded >= node_limit:
+            print(f"Node limit reached ({node_limit} nodes). Returning best solution found so far.")
+            break
+
+        course, choices = stack[-1]
+        f, slot = next(choices, (None, None))
+        # Choices are in f order, so once one cannot beat the bound none of the rest can
+        if slot is None or f >= best_cost:
+            if slot is not None and recorder is not None:
+                recorder.count("nodes pruned by bound")
+            stack.pop()
+            if stack:
+                state.undo() # Back out of the value chosen one level up
             continue
-            
-        if min_valid_count == 0:
+
+        state.apply(course, slot)
+        if state.is_complete():
+            # Calculate FINAL cost including MinFilled
+            cost = final_cost(state, weights)
+            if cost < best_cost:
+                best_cost = cost
+                best_solution = state.copy()
+                print(f"Improved solution found with cost: {best_cost}")
+                if stats is not None:
+                    stats.setdefault("first_solution_time", time.time())
+                if recorder is not None:
+                    recorder.incumbent(best_cost, "depth-first branch and bound")
+                if on_solution is not None and on_solution(best_cost, best_solution):
+                    print("Search stopped by the solution callback.")
+                    break
+            state.undo()
             continue
-            
-        # Value Ordering: LCV
-        scored_slots = []
-        for slot in best_valid_slots:
-            next_state = state.assign(best_var, slot)
-            g = next_state.calculate_cost(weights)
-            h = calculate_heuristic(next_state, weights)
-            f_new = g + h
-            scored_slots.append((f_new, next_state))
-            
-        scored_slots.sort(key=lambda x: x[0])
-        
-        for f_new, next_state in scored_slots:
-            if f_new < best_cost:
-                heapq.heappush(pq, (f_new, next_state))
 
+        # Stronger bound, only for nodes the cheap one could not prune
+        if flow_bound:
+            flow_evaluated += 1
+            if state.cost + assignment_bound(state) >= best_cost:
+                flow_pruned += 1
+                state.undo()
+                continue
+
+        nodes_expanded += 1
+        if nodes_expanded % 1000 == 0:
+            print(f"Nodes expanded: {nodes_expanded}, Depth: {len(stack)}, Current Best Cost: {best_cost}")
+            if recorder is not None:
+                recorder.event("progress", nodes=nodes_expanded, depth=len(stack), best=best_cost)
+        course, choices = score_in_place(state, weights, best_cost)
+        stack.append((course, iter(choices)))
+
+    if flow_bound:
+        print(f"Assignment bound pruned {flow_pruned} of {flow_evaluated} nodes it was evaluated on.")
+    if stats is not None:
+        stats["nodes_expanded"] = nodes_expanded
+        stats["complete"] = not stack
+    if recorder is not None:
+        recorder.count("nodes expanded", nodes_expanded)
+        if flow_bound:
+            recorder.count("nodes pruned by assignment bound", flow_pruned)
+    return best_solution, best_cost
+
+def solve(problem, weights, forward_check=False, strategy="bestfirst", symmetry=False, flow_bound=False,
+          timeout_seconds=TIMEOUT_SECONDS, stats=None, node_limit=None, greedy_node_limit=GREEDY_NODE_LIMIT,
+          on_solution=None, use_cache=False):
+    # Weights: Wminfilled, Wpref, Wpair, Wsecdiff, pen_notpaired, pen_section
+    # strategy: "bestfirst" (branch_and_bound) or "dfbnb" (depth_first_branch_and_bound)
+    # timeout_seconds: time budget of the whole search (greedy DFS, restarts and Branch-and-Bound)
+    # stats: optional dict, filled with "initial_cost", "first_solution_time" (time.time()
+    # when the first schedule was found), "nodes_expanded" and "complete" by the Branch-and-Bound search
+    # node_limit: optional cap on the nodes Branch-and-Bound expands
+    # greedy_node_limit: node limit of the first greedy DFS
+    # on_solution: optional on_solution(cost, state), called with every improved schedule
+    # (the first one included); returning True stops the search with that schedule
+    # use_cache: look the instance and weights up in solution_cache first. A cached schedule
+    # is the starting bound (instead of the greedy DFS); the result is stored back.
+    start_time = time.time()
+    if stats is None:
+        stats = {}
+    # Key from the input as parsed (before the special tutorials are registered)
+    cache_key = solution_cache.instance_key(problem, weights) if use_cache else None
+    initial_state, failure = build_initial_state(problem, weights, forward_check, symmetry)
+    if initial_state is None:
+        return failure
+
+    deadline = start_time + timeout_seconds
+    entry = solution_cache.load(cache_key) if use_cache else None
+    best_solution = solution_cache.restore(entry, initial_state) if entry is not None else None
+    if best_solution is not None:
+        best_cost = final_cost(best_solution, weights)
+        print(f"Resuming from the cached schedule, cost {best_cost} ({entry['seconds']}s searched before).")
+    else:
+        best_solution, best_cost = find_initial_bound(initial_state, weights, greedy_node_limit, deadline)
+    stats["initial_cost"] = best_cost
+    if best_solution:
+        stats["first_solution_time"] = time.time()
+    if best_solution and on_solution is not None and on_solution(best_cost, best_solution):
+        print("Search stopped by the solution callback.")
+        return best_solution, best_cost
+
+    remaining = max(0, round(deadline - time.time(), 2))
+    if strategy == "dfbnb":
+        best_solution, best_cost = depth_first_branch_and_bound(initial_state, weights, best_solution, best_cost, remaining,
+                                                                flow_bound=flow_bound, stats=stats, node_limit=node_limit,
+                                                                on_solution=on_solution)
+    else:
+        best_solution, best_cost = branch_and_bound(initial_state, weights, best_solution, best_cost, remaining,
+                                                    flow_bound=flow_bound, stats=stats, node_limit=node_limit,
+                                                    on_solution=on_solution)
+    if use_cache and best_solution is not None:
+        solution_cache.store(cache_key, best_solution, best_cost, stats["complete"], time.time() - start_time)
     return best_solution, best_cost
@@ -1,56 +1,492 @@
+import heapq
+from array import array
+from models import SPECIAL_PARTNERS
+
+# Debug mode: cross-check every incremental cost update against a full calculate_cost
+DEBUG_COST_CHECK = False
+# Debug mode: cross-check forward-checking domains against is_valid
+DEBUG_DOMAIN_CHECK = False
+
 class State:
-    def __init__(self, problem, assignments=None, slot_usage=None, assigned_500_slots=None):
+    # Compact representation: the frontier holds many States, so keep them small
+    # and make child creation a couple of flat array copies.
+    __slots__ = ('problem', 'weights', 'cost', 'slot_of', 'usage', 'al_usage', 'group_time', 'n_assigned',
+                 'free_degree', 'domains', 'dead', 'var_heap',
+                 'potential', 'h_minfilled', 'h_pref', 'trail')
+
+    def __init__(self, problem, weights=None):
         self.problem = problem
-        self.assignments = assignments if assignments is not None else {}
-        # slot_usage: slot -> {'LEC': count, 'TUT': count, 'LAB': count}
-        self.slot_usage = slot_usage if slot_usage is not None else {}
-        # assigned_500_slots: list of Slot objects occupied by 500-level courses
-        self.assigned_500_slots = assigned_500_slots if assigned_500_slots is not None else []
+        # weights: tuple passed to calculate_cost; cost: running g-cost (without MinFilled)
+        self.weights = weights
+        self.cost = 0
+        # slot_of: course index -> slot index (-1 if unassigned)
+        self.slot_of = array('h', [-1]) * len(problem.courses)
+        # usage: 3 counters per slot index (LEC, TUT, LAB), see models.USAGE_OFFSET
+        self.usage = array('H', [0]) * (3 * len(problem.slots))
+        # al_usage: slot index -> number of assigned AL courses
+        self.al_usage = array('H', [0]) * len(problem.slots)
+        # group_time: time group id -> bitmask of time occupied by its assigned members
+        self.group_time = [0] * len(problem.time_group_ids)
+        self.n_assigned = 0
+        # free_degree: course index -> number of unassigned neighbours in the constraint graph
+        if len(problem.degree) != len(problem.courses):
+            problem.build_constraint_graph()
+        self.free_degree = array('H', problem.degree)
+        # Forward checking (init_domains): course index -> bitmask of slot indices still valid.
+        # dead is set when an assignment wipes out the domain of an unassigned course.
+        self.domains = None
+        self.dead = False
+        # Lazy heap of (domain size, -free degree, course index) for select_variable
+        self.var_heap = None
+        # Undo trail of a working state (see copy and apply), None for ordinary states
+        self.trail = None
+
+        # Heuristic terms, kept up to date by assign (see heuristic()):
+        # potential: slot index -> unassigned courses whose static valid slots include it
+        # h_minfilled: sum over slots of the unavoidable MinFilled shortfall
+        # h_pref: sum of the preference lower bounds of unassigned courses
+        self.potential = array('H', [0]) * len(problem.slots)
+        self.h_pref = 0
+        for course in problem.courses:
+            for slot in problem.valid_slots.get(course, ()):
+                self.potential[slot.index] += 1
+            self.h_pref += problem.pref_bounds.get(course, 0)
+        self.h_minfilled = 0
+        for slot in problem.slots:
+            self.h_minfilled += self.slot_shortfall(slot)
+
+    @property
+    def assignments(self):
+        # course -> slot view of the schedule (for output and debugging, not the hot path)
+        courses = self.problem.courses
+        slots = self.problem.slots
+        return {courses[i]: slots[s] for i, s in enumerate(self.slot_of) if s >= 0}
+
+    def slot_for(self, course):
+        # Slot the course is assigned to, or None
+        s = self.slot_of[course.index]
+        if s < 0:
+            return None
+        return self.problem.slots[s]
+
+    def slot_total(self, slot):
+        base = 3 * slot.index
+        return self.usage[base] + self.usage[base + 1] + self.usage[base + 2]
         
+    def slot_shortfall(self, slot):
+        # MinFilled shortfall even if every unassigned course that can use the slot goes there
+        max_possible = self.slot_total(slot) + self.potential[slot.index]
+        if max_possible < slot.lecture_min:
+            return slot.lecture_min - max_possible
+        return 0
+
+    def heuristic(self):
+        # Estimate of the remaining cost (same terms as solver.calculate_heuristic). Not
+        # admissible: the MinFilled term also counts slots that may end up empty, which
+        # calculate_minfilled_cost does not penalize.
+        w_minfilled, w_pref = self.weights[0], self.weights[1]
+        return self.h_minfilled * w_minfilled + self.h_pref * w_pref
+
     def is_complete(self):
-        return len(self.assignments) == (len(self.problem.lectures) + len(self.problem.tutorials))
+        return self.n_assigned == len(self.problem.courses)
     
     def get_unassigned_courses(self):
-        all_courses = self.problem.lectures + self.problem.tutorials
-        return [c for c in all_courses if c not in self.assignments]
+        slot_of = self.slot_of
+        return [c for c in self.problem.courses if slot_of[c.index] < 0]
+
+    def copy(self, trail=None):
+        # Independent copy of this state. With trail=[] the copy is a mutable working
+        # state: apply() records every change so undo() can take it back.
+        new_state = State.__new__(State)
+        new_state.problem = self.problem
+        new_state.weights = self.weights
+        new_state.cost = self.cost
+        new_state.slot_of = self.slot_of[:]
+        new_state.usage = self.usage[:]
+        new_state.al_usage = self.al_usage[:]
+        new_state.group_time = self.group_time[:]
+        new_state.n_assigned = self.n_assigned
+        new_state.free_degree = self.free_degree[:]
+        new_state.domains = None if self.domains is None else self.domains[:]
+        new_state.dead = self.dead
+        # The lazy heap cannot be rolled back, so a working state selects by scanning
+        new_state.var_heap = None if self.var_heap is None or trail is not None else self.var_heap[:]
+        new_state.potential = self.potential[:]
+        new_state.h_minfilled = self.h_minfilled
+        new_state.h_pref = self.h_pref
+        new_state.trail = trail
+        return new_state
 
     def assign(self, course, slot):
-        # Create new state (lightweight copy)
-        new_assignments = self.assignments.copy()
-        new_assignments[course] = slot
-        
-        new_slot_usage = self.slot_usage.copy()
-        if slot not in new_slot_usage:
-            new_slot_usage[slot] = {'LEC': 0, 'TUT': 0, 'LAB': 0}
-        else:
-            new_slot_usage[slot] = new_slot_usage[slot].copy()
-            
+        # Create new state (flat copies of the arrays). group_time, potential and
+        # al_usage stay shared with this state until apply has to change them.
+        new_state = State.__new__(State)
+        new_state.problem = self.problem
+        new_state.weights = self.weights
+        new_state.cost = self.cost
+        new_state.slot_of = self.slot_of[:]
+        new_state.usage = self.usage[:]
+        new_state.al_usage = self.al_usage
+        new_state.group_time = self.group_time
+        new_state.n_assigned = self.n_assigned
+        new_state.free_degree = self.free_degree[:]
+        new_state.domains = None if self.domains is None else self.domains[:]
+        new_state.dead = False
+        new_state.var_heap = None if self.var_heap is None else self.var_heap[:]
+        new_state.potential = self.potential
+        new_state.h_minfilled = self.h_minfilled
+        new_state.h_pref = self.h_pref
+        new_state.trail = None
+        new_state.apply(course, slot)
+        return new_state
+
+    def apply(self, course, slot):
+        # Assign course -> slot in place. On a working state (copy(trail=[])) every
+        # overwritten entry goes on the trail; otherwise this is a fresh child from
+        # assign() and the arrays it still shares with its parent are copied first.
+        trail = self.trail
+        problem = self.problem
+        ci = course.index
+        si = slot.index
+        # Only the new course can change the cost, so add its contribution
+        delta = self.cost_delta(course, slot) if self.weights is not None else 0
+        if trail is not None:
+            trail.append((None, self.cost, self.h_minfilled, self.h_pref, self.n_assigned, self.dead))
+
+        if course.time_groups:
+            if trail is None:
+                self.group_time = self.group_time[:]
+            group_time = self.group_time
+            for g in course.time_groups:
+                if trail is not None:
+                    trail.append((group_time, g, group_time[g]))
+                group_time[g] |= slot.time_mask
+
+        # Heuristic terms: the course stops counting towards the potential of its valid
+        # slots and starts counting in the usage of its slot; only those slots change.
+        valid = problem.valid_slots.get(course, ())
+        touched = {s.index: s for s in valid}
+        touched[si] = slot
+        h_minfilled = self.h_minfilled
+        for s in touched.values():
+            h_minfilled -= self.slot_shortfall(s)
+        if valid:
+            if trail is None:
+                self.potential = self.potential[:]
+            potential = self.potential
+            for s in valid:
+                if trail is not None:
+                    trail.append((potential, s.index, potential[s.index]))
+                potential[s.index] -= 1
+            self.h_pref -= problem.pref_bounds.get(course, 0)
+
+        slot_of = self.slot_of
+        usage = self.usage
+        usage_index = 3 * si + course.usage_offset
+        if trail is not None:
+            trail.append((slot_of, ci, slot_of[ci]))
+            trail.append((usage, usage_index, usage[usage_index]))
+        slot_of[ci] = si
+        usage[usage_index] += 1
+        for s in touched.values():
+            h_minfilled += self.slot_shortfall(s)
+        self.h_minfilled = h_minfilled
+
+        if course.al_required:
+            if trail is None:
+                self.al_usage = self.al_usage[:]
+            else:
+                trail.append((self.al_usage, si, self.al_usage[si]))
+            self.al_usage[si] += 1
+        self.n_assigned += 1
+        free_degree = self.free_degree
+        neighbours = problem.neighbours[ci]
+        for i in neighbours:
+            if trail is not None:
+                trail.append((free_degree, i, free_degree[i]))
+            free_degree[i] -= 1
+
+        if self.domains is not None:
+            changed = self.forward_check(course, slot, usage[usage_index] >= slot.lecture_max)
+            if self.var_heap is not None:
+                # Re-key the courses whose domain size or free degree changed
+                changed.update(neighbours)
+                for i in changed:
+                    self.push_variable(i)
+
+        self.cost += delta
+
+        if DEBUG_COST_CHECK and self.weights is not None:
+            full_cost = self.calculate_cost(self.weights)
+            assert abs(full_cost - self.cost) < 1e-6, f"Cost mismatch after assigning {course.id}: delta {self.cost} vs full {full_cost}"
+        if DEBUG_DOMAIN_CHECK and self.domains is not None and not self.dead:
+            self.check_domains()
+
+    def unassign(self, course):
+        # Inverse of apply for any assigned course (local search on complete schedules).
+        # Uses the trail like apply; forward-checking domains are not maintained.
+        trail = self.trail
+        problem = self.problem
+        ci = course.index
+        slot_of = self.slot_of
+        si = slot_of[ci]
+        slot = problem.slots[si]
+        if trail is not None:
+            trail.append((None, self.cost, self.h_minfilled, self.h_pref, self.n_assigned, self.dead))
+
+        valid = problem.valid_slots.get(course, ())
+        touched = {s.index: s for s in valid}
+        touched[si] = slot
+        h_minfilled = self.h_minfilled
+        for s in touched.values():
+            h_minfilled -= self.slot_shortfall(s)
+        if valid:
+            if trail is None:
+                self.potential = self.potential[:]
+            potential = self.potential
+            for s in valid:
+                if trail is not None:
+                    trail.append((potential, s.index, potential[s.index]))
+                potential[s.index] += 1
+            self.h_pref += problem.pref_bounds.get(course, 0)
+
+        usage = self.usage
+        usage_index = 3 * si + course.usage_offset
+        if trail is not None:
+            trail.append((slot_of, ci, si))
+            trail.append((usage, usage_index, usage[usage_index]))
+        slot_of[ci] = -1
+        usage[usage_index] -= 1
+        for s in touched.values():
+            h_minfilled += self.slot_shortfall(s)
+        self.h_minfilled = h_minfilled
+
+        if course.al_required:
+            if trail is None:
+                self.al_usage = self.al_usage[:]
+            else:
+                trail.append((self.al_usage, si, self.al_usage[si]))
+            self.al_usage[si] -= 1
+        self.n_assigned -= 1
+        free_degree = self.free_degree
+        for i in problem.neighbours[ci]:
+            if trail is not None:
+                trail.append((free_degree, i, free_degree[i]))
+            free_degree[i] += 1
+
+        # A time group's mask is an OR, so rebuild it from the members still assigned
+        if course.time_groups:
+            if trail is None:
+                self.group_time = self.group_time[:]
+            group_time = self.group_time
+            slots = problem.slots
+            for g in course.time_groups:
+                mask = 0
+                for member in problem.time_group_members[g]:
+                    s = slot_of[member.index]
+                    if s >= 0:
+                        mask |= slots[s].time_mask
+                if trail is not None:
+                    trail.append((group_time, g, group_time[g]))
+                group_time[g] = mask
+
+        if self.weights is not None:
+            self.cost -= self.cost_delta(course, slot)
+
+        if DEBUG_COST_CHECK and self.weights is not None:
+            full_cost = self.calculate_cost(self.weights)
+            assert abs(full_cost - self.cost) < 1e-6, f"Cost mismatch after unassigning {course.id}: delta {self.cost} vs full {full_cost}"
+
+    def undo(self):
+        # Take back the last apply() or unassign() on a working state
+        trail = self.trail
+        entry = trail.pop()
+        while entry[0] is not None:
+            container, i, old = entry
+            container[i] = old
+            entry = trail.pop()
+        _, self.cost, self.h_minfilled, self.h_pref, self.n_assigned, self.dead = entry
+
+    def init_domains(self):
+        # Start forward checking from this state: compute every unassigned course's live domain
+        self.domains = [0] * len(self.problem.courses)
+        for course in self.get_unassigned_courses():
+            dom = 0
+            for slot in self.problem.valid_slots[course]:
+                if self.is_valid(course, slot):
+                    dom |= 1 << slot.index
+            self.domains[course.index] = dom
+            if not dom:
+                self.dead = True
+        self.rebuild_variable_heap()
+
+    def rebuild_variable_heap(self):
+        slot_of = self.slot_of
+        self.var_heap = [(self.domains[i].bit_count(), -self.free_degree[i], i)
+                         for i in range(len(slot_of)) if slot_of[i] < 0]
+        heapq.heapify(self.var_heap)
+
+    def push_variable(self, i):
+        if self.slot_of[i] < 0:
+            heapq.heappush(self.var_heap, (self.domains[i].bit_count(), -self.free_degree[i], i))
+
+    def select_variable(self):
+        # MRV (forward checking only): smallest live domain, ties broken by the most
+        # unassigned neighbours, then by course order. Outdated heap entries are skipped.
+        if self.var_heap is None:
+            # Working state (no heap): same order by a scan
+            domains = self.domains
+            free_degree = self.free_degree
+            candidates = [(domains[i].bit_count(), -free_degree[i], i)
+                          for i, s in enumerate(self.slot_of) if s < 0]
+            if not candidates:
+                return None
+            return self.problem.courses[min(candidates)[2]]
+        heap = self.var_heap
+        if len(heap) > 2 * (len(self.slot_of) - self.n_assigned) + 16:
+            # Too many outdated entries: compact so copies into children stay small
+            self.rebuild_variable_heap()
+            heap = self.var_heap
+        while heap:
+            size, neg_degree, i = heapq.heappop(heap)
+            if self.slot_of[i] < 0 and self.domains[i].bit_count() == size and self.free_degree[i] == -neg_degree:
+                return self.problem.courses[i]
+        return None
+
+    def forward_check(self, course, slot, slot_full):
+        # Remove values made invalid by course -> slot from the domains of affected
+        # unassigned courses only. Sets self.dead if a domain becomes empty.
+        # Returns the set of course indices whose domain shrank.
+        problem = self.problem
+        domains = self.domains
+        slot_of = self.slot_of
+        trail = self.trail
+        if trail is not None:
+            trail.append((domains, course.index, domains[course.index]))
+        domains[course.index] = 0
+        clash = ~problem.overlap_masks[slot.index]
+        bit = ~(1 << slot.index)
+
+        affected = []
+        # Not Compatible, lecture/tutorial, 500-level: no overlapping slot left
+        for other in problem.incompatible_map.get(course, ()):
+            affected.append((other, clash))
+        if course.parent is not None:
+            affected.append((course.parent, clash))
         if course.type == "LEC":
-            new_slot_usage[slot]['LEC'] += 1
-        elif course.type == "TUT":
-            new_slot_usage[slot]['TUT'] += 1
-        elif course.type == "LAB":
-            new_slot_usage[slot]['LAB'] += 1
-            
-        new_assigned_500_slots = self.assigned_500_slots
-        if course.is_500_level:
-            new_assigned_500_slots = list(self.assigned_500_slots) # Copy list
-            new_assigned_500_slots.append(slot)
-            
-        return State(self.problem, new_assignments, new_slot_usage, new_assigned_500_slots)
+            for tutorial in problem.tutorials_by_parent.get(course.id, ()):
+                affected.append((tutorial, clash))
+        if course.is_500_level and course.type == "LEC":
+            for other in problem.lectures_500:
+                affected.append((other, clash))
+        # Capacity: slot just filled for this course type
+        if slot_full:
+            for other in problem.courses_by_type[course.type]:
+                affected.append((other, bit))
+        # AL capacity: slot just ran out of AL room
+        if course.al_required and slot.al_max > 0 and self.al_usage[slot.index] >= slot.al_max:
+            for other in problem.al_courses:
+                affected.append((other, bit))
+        # Special tutorials constrain CPSC 351/413
+        for number, special_number in SPECIAL_PARTNERS.items():
+            if problem.special_courses.get(special_number) is course:
+                keep = clash if slot.id == "TU, 18:00" else 0
+                for other in problem.courses_by_number.get(("CPSC", number), ()):
+                    affected.append((other, keep))
+
+        changed = set()
+        for other, keep in affected:
+            i = other.index
+            if slot_of[i] < 0:
+                dom = domains[i] & keep
+                if dom != domains[i]:
+                    if trail is not None:
+                        trail.append((domains, i, domains[i]))
+                    domains[i] = dom
+                    changed.add(i)
+                if not dom:
+                    self.dead = True
+        return changed
+
+    def domain_slots(self, course):
+        # Slots in the live domain of course, in slot index order
+        slots = self.problem.slots
+        result = []
+        dom = self.domains[course.index]
+        while dom:
+            low = dom & -dom
+            result.append(slots[low.bit_length() - 1])
+            dom ^= low
+        return result
+
+    def check_domains(self):
+        for course in self.get_unassigned_courses():
+            expected = [s for s in self.problem.valid_slots[course] if self.is_valid(course, s)]
+            assert self.domain_slots(course) == expected, f"Domain mismatch for {course.id}"
+
+    def cost_delta(self, course, slot):
+        # Cost added by assigning course to slot, given the current assignments.
+        # Mirrors calculate_cost but only looks at terms that involve course.
+        w_minfilled, w_pref, w_pair, w_secdiff, pen_notpaired, pen_section = self.weights
+        slot_of = self.slot_of
+        table = self.problem.overlap_table
+        row = slot.index * self.problem.n_slots
+        delta = 0
+
+        # 1. Preferences of this course
+        for pref_slot_id, val in self.problem.preferences.get(course, ()):
+            if slot.id != pref_slot_id:
+                delta += val * w_pref
+
+        # 2. Pairs touching this course
+        for other in self.problem.pair_map.get(course, ()):
+            s = slot_of[other.index]
+            if s >= 0:
+                if not table[row + s]:
+                    delta += pen_notpaired * w_pair
+
+        # 3. SecDiff: assigned sections of the same course overlapping this slot
+        for other in self.problem.sections.get(course.section_key, ()):
+            s = slot_of[other.index]
+            if s >= 0 and other is not course:
+                if table[row + s]:
+                    delta += pen_section * w_secdiff
+
+        return delta
+
+    def symmetric_duplicate(self, course, slot):
+        # Symmetry breaking (ProblemInstance.precompute_symmetries): True if course -> slot
+        # only leads to mirror images of schedules the search covers elsewhere
+        problem = self.problem
+        canonical = problem.slot_canonical
+        key = canonical[slot.index]
+        slot_of = self.slot_of
+        # Interchangeable courses take their slots in index order
+        for i in course.twins_before:
+            s = slot_of[i]
+            if s >= 0 and canonical[s] > key:
+                return True
+        for i in course.twins_after:
+            s = slot_of[i]
+            if s >= 0 and canonical[s] < key:
+                return True
+        # Of several identical slots that are still empty, only the first one is tried
+        twins = problem.slot_twins[slot.index]
+        if twins and self.slot_total(slot) == 0:
+            for t in twins:
+                if self.slot_total(problem.slots[t]) == 0:
+                    return True
+        return False
 
     def is_valid(self, course, slot):
+        slot_of = self.slot_of
+        table = self.problem.overlap_table
+        row = slot.index * self.problem.n_slots
+
         # 1. Max Capacity
-        usage = self.slot_usage.get(slot, {'LEC': 0, 'TUT': 0, 'LAB': 0})
-        if course.type == "LEC":
-            if usage['LEC'] >= slot.lecture_max: 
-                return False
-        elif course.type == "TUT":
-            if usage['TUT'] >= slot.lecture_max: # TUT uses lecture_max (col 2)
-                return False
-        elif course.type == "LAB":
-            if usage['LAB'] >= slot.lecture_max: # LAB uses lecture_max (col 2)
-                return False
+        # TUT and LAB use lecture_max (col 2) as well
+        if self.usage[3 * slot.index + course.usage_offset] >= slot.lecture_max:
+            return False
             
         # 2. Active Learning (AL)
         # If this course requires AL but this slot doesn't have any AL capacity return false
@@ -59,44 +495,30 @@ class State:
             if al_capacity == 0:
                 return False
             elif al_capacity > 0:
-                al_taken = 0
-
-                # For all courses already in this slot, if it requires AL increment counter by 1
-                # If counter > al_capacity return false
-                for assigned_course, assigned_slot in self.assignments.items():
-                    if assigned_slot == slot:
-                        if assigned_course.al_required:
-                            al_taken += 1
-                            if al_taken >= al_capacity:
-                                return False
+                # AL courses already in this slot
+                if self.al_usage[slot.index] >= al_capacity:
+                    return False
         
         # 3. No Overlap (Lecture vs its own Tutorial)
-        if course.type == "TUT" and course.parent_id:
-            parent = self.problem.get_course(course.parent_id)
-            if parent and parent in self.assignments:
-                parent_slot = self.assignments[parent]
-                if slot.overlaps(parent_slot):
-                    return False
-        elif course.type == "LEC":
-            # Check if any of its tutorials are already assigned
-            # This requires reverse lookup or iterating assignments.
-            # Optimization: Iterate assignments is O(N), acceptable for small N.
-            for assigned_course, assigned_slot in self.assignments.items():
-                if assigned_course.type == "TUT" and assigned_course.parent_id == course.id:
-                    if slot.overlaps(assigned_slot):
-                        return False
+        if course.parent is not None:
+            s = slot_of[course.parent.index]
+            if s >= 0 and table[row + s]:
+                return False
+        # A lecture checks the occupied time of its tutorials (and 500-level lectures, see 7.)
+        for g in course.avoid_groups:
+            if slot.time_mask & self.group_time[g]:
+                return False
 
         # 4. Not Compatible
         # Optimized check using adjacency list
         if course in self.problem.incompatible_map:
             for incompatible_course in self.problem.incompatible_map[course]:
-                if incompatible_course in self.assignments:
-                    assigned_slot = self.assignments[incompatible_course]
-                    if slot.overlaps(assigned_slot):
-                        return False
+                s = slot_of[incompatible_course.index]
+                if s >= 0 and table[row + s]:
+                    return False
         
         # 5. Unwanted
-        if slot.id in self.problem.unwanted[course]:
+        if slot.index in course.unwanted_slots:
             return False
             
         # 6. Partial Assignments (Handled by pre-assignment, but check for consistency)
@@ -107,21 +529,16 @@ class State:
                 
         # 7. 500-Level
         # "All lectures with course number 5XX must be in non-overlapping time slots (pairwise incompatible)."
-        if course.is_500_level and course.type == "LEC":
-            # Check against all currently assigned 500-level LECTURES
-            for assigned_course, assigned_slot in self.assignments.items():
-                if assigned_course.is_500_level and assigned_course.type == "LEC":
-                    if slot.overlaps(assigned_slot):
-                        return False
+        # Checked above through the 500-level time group in course.avoid_groups
         
         # 8. Evening Classes
         if course.is_evening:
-            if slot.hour < 18:
+            if not slot.is_evening:
                 return False
                 
         # 9. Tuesday 11:00-12:30 (No Lectures)
         if course.type == "LEC":
-            if slot.day == "TU" and slot.hour == 11 and slot.minute == 0:
+            if slot.no_lectures:
                 return False
 
         if not self.check_special_constraints(course, slot):
@@ -129,48 +546,77 @@ class State:
 
         return True
 
+    def slot_occupants(self):
+        # slot index -> indices of the courses assigned to it
+        occupants = [[] for _ in self.problem.slots]
+        for i, s in enumerate(self.slot_of):
+            if s >= 0:
+                occupants[s].append(i)
+        return occupants
+
+    def conflict_set(self, course, slot, occupants=None):
+        # Assigned courses whose assignments make course -> slot invalid (see is_valid), as
+        # course indices. Empty if the course's own constraints rule the slot out.
+        # occupants: slot_occupants(), when explaining many values of the same state
+        problem = self.problem
+        slot_of = self.slot_of
+        table = problem.overlap_table
+        row = slot.index * problem.n_slots
+        si = slot.index
+        culprits = set()
+
+        full = self.usage[3 * si + course.usage_offset] >= slot.lecture_max
+        al_full = course.al_required and slot.al_max > 0 and self.al_usage[si] >= slot.al_max
+        if full or al_full:
+            if occupants is None:
+                occupants = self.slot_occupants()
+            courses = problem.courses
+            for i in occupants[si]:
+                other = courses[i]
+                if (full and other.type == course.type) or (al_full and other.al_required):
+                    culprits.add(i)
+        others = list(problem.incompatible_map.get(course, ()))
+        if course.parent is not None:
+            others.append(course.parent)
+        for g in course.avoid_groups:
+            others.extend(problem.time_group_members[g])
+        if course.dept == "CPSC" and course.number in SPECIAL_PARTNERS:
+            special = problem.special_courses.get(SPECIAL_PARTNERS[course.number])
+            if special is not None:
+                others.append(special)
+        for other in others:
+            s = slot_of[other.index]
+            if s >= 0 and other is not course and table[row + s]:
+                culprits.add(other.index)
+        return culprits
+
     # When assigning 351 and 413 classes/tutorials they cannot be overlapping with 851/913
     def check_special_constraints(self, course, slot):
+        if course.dept != "CPSC" or course.number not in SPECIAL_PARTNERS:
+            return True
 
-        if course.number == 351 and course.dept == "CPSC":
-            # Check if 851 is assigned
-            c851 = None
-            for c in self.problem.lectures:
-                if c.dept == "CPSC" and c.number == 851:
-                    c851 = c
-                    break
-            if c851 and c851 in self.assignments:
-                # 851 is assigned, so it MUST be TU 18:00.
-                if self.assignments[c851].id != "TU, 18:00":
-                    return False  # Should have been caught earlier, but for safety
-                if slot.overlaps(self.assignments[c851]):
-                    return False
-
-        if course.number == 413 and course.dept == "CPSC":
-            # Check if 851 is assigned
-            c913 = None
-            for c in self.problem.lectures:
-                if c.dept == "CPSC" and c.number == 913:
-                    c851 = c
-                    break
-            if c913 and c913 in self.assignments:
-                # 913 is assigned, so it MUST be TU 18:00.
-                if self.assignments[c913].id != "TU, 18:00":
-                    return False  # Should have been caught earlier, but for safety
-                if slot.overlaps(self.assignments[c913]):
-                    return False
+        # Check if 851 (for 351) or 913 (for 413) is assigned
+        special = self.problem.special_courses.get(SPECIAL_PARTNERS[course.number])
+        if special is not None and self.slot_of[special.index] >= 0:
+            special_slot = self.slot_for(special)
+            # The special tutorial is assigned, so it MUST be TU 18:00.
+            if special_slot.id != "TU, 18:00":
+                return False  # Should have been caught earlier, but for safety
+            if slot.overlaps(special_slot):
+                return False
 
         return True
 
     def __lt__(self, other):
         # Tie-breaker for Priority Queue
         # Prefer states with MORE assignments (closer to goal)
-        return len(self.assignments) > len(other.assignments)
+        return self.n_assigned > other.n_assigned
 
 
     def calculate_cost(self, weights):
         w_minfilled, w_pref, w_pair, w_secdiff, pen_notpaired, pen_section = weights
         cost = 0
+        assignments = self.assignments
         
         # 1. MinFilled
         # "If slot usage < min, penalty = (min - usage) * weight"
@@ -178,8 +624,8 @@ class State:
         # We ignore pen_lecturemin/pen_tutorialmin as per prompt formula.
         
         # 2. Preferences
-        for course, slot in self.assignments.items():
-            prefs = self.problem.preferences[course]
+        for course, slot in assignments.items():
+            prefs = self.problem.preferences.get(course, ())
             for pref_slot_id, val in prefs:
                 if slot.id != pref_slot_id:
                     cost += val * w_pref
@@ -187,15 +633,15 @@ class State:
         # 3. Pair
         # "If pair(A, B) and time(A) != time(B), add pen_notpaired."
         for c1, c2 in self.problem.pairs:
-            if c1 in self.assignments and c2 in self.assignments:
-                s1 = self.assignments[c1]
-                s2 = self.assignments[c2]
+            if c1 in assignments and c2 in assignments:
+                s1 = assignments[c1]
+                s2 = assignments[c2]
                 if not s1.overlaps(s2):
                     cost += pen_notpaired * w_pair
         
         # 4. SecDiff
         # "If two sections of the same course are in the same slot, add pen_section."
-        assigned_list = list(self.assignments.items())
+        assigned_list = list(assignments.items())
         for i in range(len(assigned_list)):
             c1, s1 = assigned_list[i]
             for j in range(i + 1, len(assigned_list)):
@@ -208,9 +654,10 @@ class State:
         return cost
 
     def calculate_minfilled_cost(self, w_minfilled):
+        # Only slots that are in use are penalized
         cost = 0
-        for slot, usage in self.slot_usage.items():
-            total_usage = usage['LEC'] + usage['TUT'] + usage['LAB']
-            if total_usage < slot.lecture_min:
+        for slot in self.problem.slots:
+            total_usage = self.slot_total(slot)
+            if 0 < total_usage < slot.lecture_min:
                 cost += (slot.lecture_min - total_usage) * w_minfilled
         return cost